@@ -0,0 +1,57 @@
+"""
+Token authentication with tokens and their users kept in the cache.
+
+TokenAuthentication loads the token with its user on every request.
+Here the token is taken from the cache for AUTH_TOKEN_CACHE_TIMEOUT
+seconds. The entry is deleted when the token is deleted (logout), when
+the user is saved (password change, deactivation) and when
+state_version of the user changes, see api.signals and api.relations.
+Tokens are deleted by other processes too (admin, worker), so the cache
+must be shared by all of them, see CACHES in settings and api.checks.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_cache_key(key):
+    # tokens are not kept in cache keys as they are
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def user_cache_key(user_id):
+    """The entry keeps the key of the token of the user."""
+    return f'auth:user:{user_id}'
+
+
+def invalidate_token(key):
+    cache.delete(token_cache_key(key))
+
+
+def invalidate_user(user_id):
+    """Deletes the cached token of the user now and after commit,
+    so requests do not see the state before the changes."""
+    def delete():
+        token_key = cache.get(user_cache_key(user_id))
+        if token_key is not None:
+            cache.delete_many([token_key, user_cache_key(user_id)])
+    delete()
+    transaction.on_commit(delete)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        token_key = token_cache_key(key)
+        token = cache.get(token_key)
+        if token is None:
+            _, token = super().authenticate_credentials(key)
+            timeout = getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 60)
+            cache.set_many({
+                token_key: token,
+                user_cache_key(token.user_id): token_key,
+            }, timeout)
+        return token.user, token
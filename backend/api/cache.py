@@ -0,0 +1,96 @@
+"""
+Cache of recipe responses for anonymous users.
+
+For anonymous users is_favorited, is_in_shopping_cart and is_subscribed
+are always False, so the response depends only on the url.
+Keys contain versions kept in the cache:
+the version of the recipe for details and the version of all recipes
+for lists. Changing a version (see api.signals) makes old entries
+unreachable, they expire by timeout.
+When several requests miss the same key at once, only one of them
+computes the response, the others wait for it (single-flight).
+The lock is taken by cache.add(), so the exclusion holds only with
+a cache backend where add() is atomic and shared by all processes,
+such as memcached (see CACHES in settings).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+LIST_VERSION_KEY = 'recipes:list:version'
+# how long to wait for the response computed by another request
+LOCK_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _recipe_version_key(pk):
+    return f'recipes:detail:{pk}:version'
+
+
+def invalidate_recipes(recipe_ids):
+    """Outdates all recipe lists and details of the given recipes."""
+    versions = {LIST_VERSION_KEY: _new_version()}
+    for pk in recipe_ids:
+        versions[_recipe_version_key(pk)] = _new_version()
+    cache.set_many(versions, timeout=None)
+
+
+def _request_key(request):
+    """Normalized url: parameters are sorted,
+    host is kept because links and images are absolute."""
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()
+    )
+    url = f'{request.build_absolute_uri("/")}|{request.path}|{params}'
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+def get_or_compute(key, compute):
+    """Returns cached value or computes it, only one request at a time
+    computes the value for the key."""
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if time.monotonic() > deadline:
+            # the request holding the lock is too slow or died
+            break
+    try:
+        value = compute()
+        cache.set(key, value, timeout=settings.RECIPES_CACHE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+def get_recipe_list(request, compute):
+    """compute returns data of the response (e.g. response.data)."""
+    key = f'recipes:list:{_version(LIST_VERSION_KEY)}:{_request_key(request)}'
+    return get_or_compute(key, compute)
+
+
+def get_recipe(request, pk, compute):
+    version = _version(_recipe_version_key(pk))
+    key = f'recipes:detail:{pk}:{version}:{_request_key(request)}'
+    return get_or_compute(key, compute)
@@ -0,0 +1,27 @@
+"""
+Cached responses, per-user sets and tokens (api.cache, api.engagement,
+api.authentication) are invalidated by other processes too: the worker,
+the popularity job, the admin. A cache local to one process keeps
+invalidated entries, e.g. a deleted token, until they expire.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in LOCAL_CACHES:
+        return []
+    return [Warning(
+        f'{backend} is not shared between processes, invalidated tokens '
+        'and cached responses stay valid in other processes until '
+        'they expire.',
+        hint='Use memcached, see CACHE_BACKEND and CACHE_LOCATION.',
+        id='api.W001',
+    )]
@@ -0,0 +1,46 @@
+"""
+Conditional GET: responses get ETag and Last-Modified headers,
+requests with matching If-None-Match or If-Modified-Since get
+304 Not Modified without running the view.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from recipes.models import TableVersion
+
+
+def make_etag(*parts):
+    return quote_etag(
+        hashlib.md5('|'.join(str(part) for part in parts).encode()
+                    ).hexdigest()
+    )
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    """
+    etag is made by make_etag, last_modified is datetime or None.
+    get_response is called only if the client does not have
+    the actual version.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        response = get_response()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def table_response(request, table, get_response):
+    """Response with the whole reference table (tags, ingredients)
+    or its rows, validated by the version of the table."""
+    version, updated_at = TableVersion.get(table)
+    return conditional_response(
+        request, make_etag(table, version), updated_at, get_response
+    )
@@ -0,0 +1,74 @@
+"""
+Ids of recipes favorited and added to the shopping cart by a user,
+is_favorited and is_in_shopping_cart are answered by lookups in them
+without SQL for each recipe.
+
+Sets are kept in the cache under state_version of the user, which is
+changed in the same transaction as favorites and shopping carts
+(see recipes.signals and api.relations), so there is nothing
+to invalidate: a new version does not see old sets.
+Writes of api.relations put the changed sets under the new version,
+so the next request does not load them from the database again.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Favorite, ShoppingCart
+
+User = get_user_model()
+
+# name of the set: model
+MODELS = {'favorites': Favorite, 'carts': ShoppingCart}
+TIMEOUT = 24 * 60 * 60
+
+
+def _key(user_id, version):
+    return f'engagement:{user_id}:{version}'
+
+
+def get_sets(user):
+    """{'favorites': set of recipe ids, 'carts': set of recipe ids},
+    loaded once per request."""
+    loaded = getattr(user, '_engagement', None)
+    if loaded is not None and loaded[0] == user.state_version:
+        return loaded[1]
+    key = _key(user.pk, user.state_version)
+    sets = cache.get(key)
+    if sets is None:
+        sets = {
+            name: set(model.objects.filter(user=user).values_list(
+                'recipe_id', flat=True
+            ))
+            for name, model in MODELS.items()
+        }
+        cache.set(key, sets, TIMEOUT)
+    user._engagement = (user.state_version, sets)
+    return sets
+
+
+def changed(user, name, recipe_ids, delta):
+    """
+    Called after recipe_ids were added to (delta > 0) or removed from
+    the set of the user and state_version was increased by one.
+    If no one else has changed the version meanwhile, the cached sets
+    with the change are put under the new version after commit.
+    """
+    sets = cache.get(_key(user.pk, user.state_version))
+    if sets is None:
+        return
+    version = User.objects.filter(pk=user.pk).values_list(
+        'state_version', flat=True
+    ).first()
+    if version != user.state_version + 1:
+        return
+    sets = {**sets, name: set(sets[name])}
+    if delta > 0:
+        sets[name].update(recipe_ids)
+    else:
+        sets[name].difference_update(recipe_ids)
+    user.state_version = version
+    user._engagement = (version, sets)
+    transaction.on_commit(
+        lambda: cache.set(_key(user.pk, version), sets, TIMEOUT)
+    )
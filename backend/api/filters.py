@@ -1,6 +1,14 @@
 import django_filters
 
 from recipes.models import Recipe, Tag, Ingredient
+from recipes.search import search_recipes
+
+# ordering parameter: order_by of recipes, the last field is unique
+RECIPE_ORDERINGS = {
+    'new': ('-created_at', '-id'),
+    # stored score read by recipe_popularity_id_idx, see recipes.popularity
+    'popular': ('-popularity', '-id'),
+}
 
 
 class RecipeFilter(django_filters.FilterSet):
@@ -13,10 +21,18 @@ class RecipeFilter(django_filters.FilterSet):
         to_field_name='slug',
         queryset=Tag.objects.all(),
     )
+    search = django_filters.CharFilter(method='filter_search')
+    ordering = django_filters.ChoiceFilter(
+        choices=[(ordering, ordering) for ordering in RECIPE_ORDERINGS],
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('is_favorited', 'is_in_shopping_cart', 'tags', 'author',)
+        fields = (
+            'is_favorited', 'is_in_shopping_cart', 'tags', 'author', 'search',
+            'ordering',
+        )
 
     def filter_is_favorited(self, queryset, name, value):
         if value:
@@ -30,6 +46,14 @@ class RecipeFilter(django_filters.FilterSet):
                 return queryset.filter(carts__user=self.request.user)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        """Full-text search by name, ingredients and description,
+        the most relevant recipes first."""
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
 
 class IngredientFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(lookup_expr='istartswith')
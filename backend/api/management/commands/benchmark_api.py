@@ -0,0 +1,294 @@
+import io
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.db.models import Count
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+
+BASELINE = (Path(__file__).resolve().parent.parent.parent
+            / 'benchmark_baseline.json')
+# dataset the baseline is measured on, generate_data options
+DATASET = {'users': 500, 'recipes': 3000, 'tags': 6, 'seed': 2023}
+
+# name: (method, url, authenticated), url is formatted with ids
+# of the dataset, see Command.dataset_ids.
+# Writes are pairs of requests which return the database
+# to the initial state, so every repeat measures the same thing.
+SCENARIOS = {
+    'recipes_list': ('GET', '/api/recipes/', True),
+    'recipes_list_anonymous': ('GET', '/api/recipes/', False),
+    'recipes_list_page': ('GET', '/api/recipes/?page=5&limit=6', True),
+    'recipes_list_cursor': ('GET', '/api/recipes/?cursor=&limit=6', True),
+    'recipes_filter_tags': (
+        'GET', '/api/recipes/?tags={tag}&tags={other_tag}', True
+    ),
+    'recipes_filter_author': ('GET', '/api/recipes/?author={author}', True),
+    'recipes_filter_favorited': ('GET', '/api/recipes/?is_favorited=1', True),
+    'recipes_filter_shopping_cart': (
+        'GET', '/api/recipes/?is_in_shopping_cart=1', True
+    ),
+    'recipes_search': ('GET', '/api/recipes/?search=молоко', True),
+    'recipe_detail': ('GET', '/api/recipes/{recipe}/', True),
+    'recipe_detail_anonymous': ('GET', '/api/recipes/{recipe}/', False),
+    'feed': ('GET', '/api/recipes/feed/', True),
+    'feed_cursor': ('GET', '/api/recipes/feed/?cursor=&limit=6', True),
+    'users_list': ('GET', '/api/users/', True),
+    'user_detail': ('GET', '/api/users/{author}/', True),
+    'users_me': ('GET', '/api/users/me/', True),
+    'subscriptions': (
+        'GET', '/api/users/subscriptions/?recipes_limit=3', True
+    ),
+    'download_shopping_cart': (
+        'GET', '/api/recipes/download_shopping_cart/', True
+    ),
+    'tags_list': ('GET', '/api/tags/', True),
+    'ingredients_prefix': ('GET', '/api/ingredients/?name=мо', True),
+    'ingredients_search': ('GET', '/api/ingredients/?search=малако', True),
+    'favorite_write': ('POST+DELETE', '/api/recipes/{recipe}/favorite/', True),
+    'shopping_cart_write': (
+        'POST+DELETE', '/api/recipes/{recipe}/shopping_cart/', True
+    ),
+    'subscribe_write': ('POST+DELETE', '/api/users/{author}/subscribe/', True),
+}
+EXPECTED_STATUS = {'GET': 200, 'POST': 201, 'DELETE': 204}
+
+
+# p95 of fewer timings is their maximum, it is not compared
+MIN_TAIL_REPEAT = 20
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+# запуск: python manage.py benchmark_api
+class Command(BaseCommand):
+    help = ('Замер времени ответа и числа SQL-запросов всех эндпоинтов API '
+            'на тестовой базе с фиксированными данными и сравнение '
+            f'с базовыми значениями из {BASELINE.name}. '
+            'Завершается с ошибкой, если результат стал хуже порога.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*',
+            help=f'Сценарии, по умолчанию все: {", ".join(SCENARIOS)}.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=100,
+            help='Сколько раз выполнить каждый запрос.'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.5,
+            help='Допустимое относительное ухудшение p50, 0.5 - на 50%%.'
+        )
+        parser.add_argument(
+            '--p95-threshold', type=float, default=2,
+            help='Допустимое относительное ухудшение p95, 2 - в 3 раза: '
+                 'p95 нескольких запросов зависит от случайных пауз, '
+                 'он ловит только большие выбросы. Не сравнивается, '
+                 f'если --repeat меньше {MIN_TAIL_REPEAT}.'
+        )
+        parser.add_argument(
+            '--min-delta', type=float, default=5,
+            help='Ухудшение меньше стольких мс не считается ошибкой.'
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help=f'Записать результаты в {BASELINE.name}.'
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять тестовую базу, чтобы не заполнять её снова.'
+        )
+
+    def seed(self):
+        """Fills the test database with the fixed dataset."""
+        if Recipe.objects.count() >= DATASET['recipes']:
+            return
+        call_command(
+            'import_ingredients',
+            str(settings.BASE_DIR / 'data' / 'ingredients.json'),
+            stdout=self.devnull,
+        )
+        call_command(
+            'generate_data', workers=1, stdout=self.devnull, **DATASET
+        )
+
+    def dataset_ids(self):
+        """Objects used in urls: the user with the biggest shopping cart
+        and ids of objects the user has no relations with yet."""
+        user = User.objects.annotate(
+            cart_size=Count('carts')
+        ).order_by('-cart_size', 'pk').first()
+        if user is None or not user.cart_size:
+            raise CommandError('В тестовой базе нет списков покупок.')
+        tags = list(Tag.objects.order_by('pk').values_list('slug', flat=True))
+        return user, {
+            'tag': tags[0],
+            'other_tag': tags[-1],
+            'author': User.objects.exclude(pk=user.pk).exclude(
+                following__user=user
+            ).order_by('-recipes_count', 'pk').values_list(
+                'pk', flat=True
+            ).first(),
+            'recipe': Recipe.objects.exclude(favorites__user=user).exclude(
+                carts__user=user
+            ).order_by('-favorites_count', 'pk').values_list(
+                'pk', flat=True
+            ).first(),
+        }
+
+    def measure(self, client, method, url, repeat):
+        """Returns request times in ms and the number of SQL queries
+        of the last repeat. The first request is a warm-up."""
+        methods = method.split('+')
+        timings = []
+        for number in range(repeat + 1):
+            # the query log is limited, queries of a full log
+            # are not counted
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for request_method in methods:
+                    response = getattr(client, request_method.lower())(url)
+                    if response.status_code != EXPECTED_STATUS[
+                            request_method]:
+                        raise CommandError(
+                            f'{request_method} {url}: '
+                            f'{response.status_code} {response.content[:200]}'
+                        )
+                    # streaming responses are read completely
+                    if getattr(response, 'streaming', False):
+                        b''.join(response.streaming_content)
+                elapsed = (time.perf_counter() - started) * 1e3
+            if number:
+                timings.append(elapsed)
+        return {
+            'p50': round(statistics.median(timings), 2),
+            'p95': round(percentile(timings, 95), 2),
+            'queries': len(queries),
+        }
+
+    def compare(self, name, result, baseline, options):
+        """Returns the list of regressions of the scenario."""
+        if baseline is None:
+            return []
+        problems = []
+        if result['queries'] > baseline['queries']:
+            problems.append(
+                f'SQL-запросов {result["queries"]} '
+                f'вместо {baseline["queries"]}'
+            )
+        # the median is stable between runs and is the gate,
+        # the tail is compared with a wide margin
+        percentiles = [('p50', options['threshold'])]
+        if options['repeat'] >= MIN_TAIL_REPEAT:
+            percentiles.append(('p95', options['p95_threshold']))
+        for percentile_name, threshold in percentiles:
+            allowed = max(
+                baseline[percentile_name] * (1 + threshold),
+                baseline[percentile_name] + options['min_delta'],
+            )
+            if result[percentile_name] > allowed:
+                problems.append(
+                    f'{percentile_name} {result[percentile_name]} мс, '
+                    f'допустимо до {allowed:.2f} мс'
+                )
+        return [f'{name}: {problem}' for problem in problems]
+
+    def run_scenarios(self, names, options):
+        user, ids = self.dataset_ids()
+        token, _ = Token.objects.get_or_create(user=user)
+        clients = {False: APIClient(), True: APIClient()}
+        clients[True].credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        results = {}
+        for name in names:
+            method, url, authenticated = SCENARIOS[name]
+            results[name] = self.measure(
+                clients[authenticated], method, url.format(**ids),
+                options['repeat']
+            )
+            self.stdout.write(
+                f'{name:32} p50 {results[name]["p50"]:8.2f} мс  '
+                f'p95 {results[name]["p95"]:8.2f} мс  '
+                f'SQL {results[name]["queries"]}'
+            )
+        return results
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(unknown)}')
+        self.devnull = io.StringIO()
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb']
+        )
+        try:
+            # the configured cache may be shared with a running server,
+            # images of the dataset are not written to the real media
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(MEDIA_ROOT=media_root, CACHES={
+                    'default': {
+                        'BACKEND':
+                            'django.core.cache.backends.locmem.LocMemCache',
+                    },
+                }):
+                    self.seed()
+                    results = self.run_scenarios(names, options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+
+        # timings and queries differ between databases,
+        # baselines are kept for each of them
+        baselines = (json.loads(BASELINE.read_text())
+                     if BASELINE.exists() else {})
+        vendor_baselines = baselines.setdefault(connection.vendor, {})
+        if options['update_baseline']:
+            vendor_baselines.update(results)
+            BASELINE.write_text(
+                json.dumps(baselines, indent=2, sort_keys=True) + '\n'
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовые значения записаны в {BASELINE}.'
+            ))
+            return
+        problems = [
+            problem
+            for name, result in results.items()
+            for problem in self.compare(
+                name, result, vendor_baselines.get(name), options
+            )
+        ]
+        if problems:
+            raise CommandError('Регрессия производительности:\n'
+                               + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            'Результаты не хуже базовых значений.'
+        ))
@@ -0,0 +1,88 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext,
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication
+
+User = get_user_model()
+
+AUTHENTICATIONS = {
+    'TokenAuthentication': TokenAuthentication,
+    'CachedTokenAuthentication': CachedTokenAuthentication,
+}
+
+
+# запуск: python manage.py benchmark_auth --repeat 2000
+class Command(BaseCommand):
+    help = ('Замер времени и числа SQL-запросов аутентификации '
+            'по токену на один запрос: без кэша и с кэшем.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=1000,
+            help='Сколько запросов аутентифицировать.'
+        )
+
+    def measure(self, authentication, key, repeat):
+        """Returns average time in microseconds and the number
+        of SQL queries of one request. The first request is a warm-up."""
+        factory = APIRequestFactory()
+        timings = []
+        for number in range(repeat + 1):
+            request = Request(factory.get(
+                '/api/recipes/', HTTP_AUTHORIZATION=f'Token {key}'
+            ))
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                authentication.authenticate(request)
+                elapsed = time.perf_counter() - started
+            if number:
+                timings.append(elapsed)
+        return sum(timings) / len(timings) * 1e6, len(queries)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            # the configured cache may be shared with a running server
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }}):
+                user = User.objects.create_user(
+                    username='benchmark', email='benchmark@example.com',
+                    password='benchmark', first_name='Benchmark',
+                    last_name='Benchmark',
+                )
+                key = Token.objects.create(user=user).key
+                results = {
+                    name: self.measure(
+                        authentication(), key, options['repeat']
+                    )
+                    for name, authentication in AUTHENTICATIONS.items()
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, (average, queries) in results.items():
+            self.stdout.write(
+                f'{name:26} {average:8.1f} мкс на запрос  SQL {queries}'
+            )
+        uncached, cached = (average for average, _ in results.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'С кэшем быстрее в {uncached / cached:.1f} раз.'
+        ))
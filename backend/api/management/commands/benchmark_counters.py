@@ -0,0 +1,146 @@
+import re
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from api.relations import RELATIONS
+from recipes.models import Recipe
+
+User = get_user_model()
+
+RECIPE_UPDATE = re.compile(r'\s*UPDATE\s+"?recipes_recipe"?\s', re.IGNORECASE)
+
+
+class RecipeUpdates:
+    """Counts UPDATE statements of the recipe table,
+    see connection.execute_wrapper."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if RECIPE_UPDATE.match(sql):
+            with self.lock:
+                self.count += 1
+        return execute(sql, params, many, context)
+
+
+# запуск: python manage.py benchmark_counters --threads 8 --repeat 200
+class Command(BaseCommand):
+    help = ('Замер добавления и удаления в избранное одного рецепта '
+            'из нескольких потоков без шардов счётчиков и с ними, '
+            'число UPDATE строки рецепта. Нужна база, допускающая '
+            'параллельную запись (PostgreSQL).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Сколько пользователей одновременно меняют избранное.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Сколько раз каждый поток добавляет и удаляет рецепт.'
+        )
+        parser.add_argument(
+            '--shards', type=int, default=16,
+            help='RECIPE_COUNTER_SHARDS во втором замере.'
+        )
+
+    def toggle(self, user, recipe_id, repeat, updates, errors):
+        """Adds and removes the favorite as FavoriteViewSet does,
+        one transaction per request."""
+        relation = RELATIONS['favorite']
+        try:
+            with connection.execute_wrapper(updates):
+                for _ in range(repeat):
+                    with transaction.atomic():
+                        relation.insert(user, recipe_id)
+                    with transaction.atomic():
+                        relation.delete(user, recipe_id)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    def measure(self, users, recipe_id, repeat, shards):
+        """Returns requests per second and the number of UPDATEs
+        of the recipe row."""
+        updates = RecipeUpdates()
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.toggle,
+                args=(user, recipe_id, repeat, updates, errors),
+            )
+            for user in users
+        ]
+        with override_settings(RECIPE_COUNTER_SHARDS=shards):
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'Ошибка в потоке: {errors[0]!r}')
+        return 2 * repeat * len(users) / elapsed, updates.count
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            # the configured cache may be shared with a running server
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }}):
+                users = [
+                    User.objects.create_user(
+                        username=f'benchmark{number}',
+                        email=f'benchmark{number}@example.com',
+                        password='benchmark', first_name='Benchmark',
+                        last_name='Benchmark',
+                    )
+                    for number in range(options['threads'])
+                ]
+                recipe = Recipe.objects.create(
+                    name='Рецепт', text='Текст', author=users[0],
+                    image='recipes/benchmark.jpg', cooking_time=10,
+                )
+                results = {
+                    shards: self.measure(
+                        users, recipe.pk, options['repeat'], shards
+                    )
+                    for shards in (0, options['shards'])
+                }
+                favorites = Recipe.objects.with_counters().get(
+                    pk=recipe.pk
+                ).favorites_total
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for shards, (rate, updates) in results.items():
+            self.stdout.write(
+                f'RECIPE_COUNTER_SHARDS={shards:<4} {rate:8.0f} запросов/с  '
+                f'UPDATE строки рецепта {updates}'
+            )
+        if favorites:
+            raise CommandError(f'Счётчик избранного {favorites}, ожидался 0.')
+        if results[options['shards']][1]:
+            raise CommandError(
+                'С шардами запросы избранного изменяют строку рецепта.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'С шардами строка рецепта не изменяется.'
+        ))
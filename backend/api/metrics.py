@@ -0,0 +1,226 @@
+"""
+Performance metrics of requests.
+
+api.middleware.PerformanceMiddleware measures each request: SQL queries
+and their time, time of serializers and the total time. They are sent
+to the client in Server-Timing header and added to histograms by route
+(view name) and method.
+
+Serializers are timed by viewsets with TimedSerializersMixin,
+serializers created by the views themselves are wrapped by timed.
+Serializer classes are not changed, so other code using them
+is not measured.
+
+Every gunicorn worker keeps its own histograms and writes them to the
+cache at most every METRICS_FLUSH_INTERVAL seconds, the metrics endpoint
+sums the histograms of all workers and renders them in Prometheus text
+format.
+"""
+import contextvars
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+WORKERS_KEY = 'metrics:workers'
+WORKER_KEY = f'metrics:worker:{socket.gethostname()}:{os.getpid()}'
+# histograms of dead workers disappear from the cache after a day
+TIMEOUT = 24 * 60 * 60
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+# metric: (help, buckets)
+HISTOGRAMS = {
+    'duration_seconds': ('Total time of the request', SECONDS_BUCKETS),
+    'db_duration_seconds': ('Time of SQL queries', SECONDS_BUCKETS),
+    'serialize_duration_seconds': ('Time of serializers', SECONDS_BUCKETS),
+    'queries': ('Number of SQL queries', QUERIES_BUCKETS),
+}
+PREFIX = 'foodgram_request_'
+
+current = contextvars.ContextVar('request_metrics', default=None)
+# serializer class: its timed subclass
+timed_classes = {}
+
+
+class RequestMetrics:
+    """Measurements of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.serialize_time = 0
+        self.serializing = False
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Wrapper of database cursors, see connection.execute_wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def observations(self):
+        return {
+            'duration_seconds': time.perf_counter() - self.started,
+            'db_duration_seconds': self.db_time,
+            'serialize_duration_seconds': self.serialize_time,
+            'queries': self.queries,
+        }
+
+
+class TimedRepresentation:
+    """Adds the time of the outermost to_representation to the metrics
+    of the current request, nested serializers are not counted twice."""
+
+    def to_representation(self, instance):
+        metrics = current.get()
+        if metrics is None or metrics.serializing:
+            return super().to_representation(instance)
+        metrics.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serialize_time += time.perf_counter() - started
+            metrics.serializing = False
+
+
+def timed(serializer_class):
+    """Subclass of the serializer class with the same name,
+    timed by TimedRepresentation."""
+    if serializer_class not in timed_classes:
+        timed_classes[serializer_class] = type(
+            serializer_class.__name__,
+            (TimedRepresentation, serializer_class),
+            {'__module__': serializer_class.__module__},
+        )
+    return timed_classes[serializer_class]
+
+
+class TimedSerializersMixin:
+    """Viewset mixin timing serializers of get_serializer."""
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('context', self.get_serializer_context())
+        return timed(self.get_serializer_class())(*args, **kwargs)
+
+
+class Registry:
+    """Histograms of this process:
+    {(route, method): {'statuses': {status: count},
+                       metric: [count per bucket..., count, sum]}}"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.flushed = 0
+
+    def observe(self, route, method, status, observations):
+        with self.lock:
+            histograms = self.routes.setdefault((route, method), {
+                'statuses': {},
+                **{
+                    metric: [0] * (len(buckets) + 2)
+                    for metric, (_, buckets) in HISTOGRAMS.items()
+                },
+            })
+            statuses = histograms['statuses']
+            statuses[status] = statuses.get(status, 0) + 1
+            for metric, value in observations.items():
+                values = histograms[metric]
+                for number, bound in enumerate(HISTOGRAMS[metric][1]):
+                    if value <= bound:
+                        values[number] += 1
+                values[-2] += 1
+                values[-1] += value
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+        if time.monotonic() - self.flushed >= interval:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [route, method, {
+                    key: (dict(value) if key == 'statuses' else list(value))
+                    for key, value in histograms.items()
+                }]
+                for (route, method), histograms in self.routes.items()
+            ]
+
+    def flush(self):
+        """Writes histograms of the process to the cache."""
+        self.flushed = time.monotonic()
+        cache.set(WORKER_KEY, self.snapshot(), TIMEOUT)
+        workers = cache.get(WORKERS_KEY) or []
+        if WORKER_KEY not in workers:
+            cache.set(WORKERS_KEY, workers + [WORKER_KEY], TIMEOUT)
+
+
+registry = Registry()
+
+
+def collect():
+    """Sums histograms of all workers."""
+    registry.flush()
+    workers = cache.get(WORKERS_KEY) or []
+    snapshots = cache.get_many(workers)
+    if len(snapshots) < len(workers):
+        cache.set(WORKERS_KEY, list(snapshots), TIMEOUT)
+    total = {}
+    for snapshot in snapshots.values():
+        for route, method, histograms in snapshot:
+            summed = total.setdefault((route, method), {
+                'statuses': {},
+                **{
+                    metric: [0] * len(histograms[metric])
+                    for metric in HISTOGRAMS
+                },
+            })
+            for status, count in histograms['statuses'].items():
+                summed['statuses'][status] = (
+                    summed['statuses'].get(status, 0) + count
+                )
+            for metric in HISTOGRAMS:
+                summed[metric] = [
+                    a + b for a, b in zip(summed[metric], histograms[metric])
+                ]
+    return total
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus(routes):
+    """Text exposition format of Prometheus."""
+    lines = [
+        f'# HELP {PREFIX}total Number of requests',
+        f'# TYPE {PREFIX}total counter',
+    ]
+    for (route, method), histograms in sorted(routes.items()):
+        for status, count in sorted(histograms['statuses'].items()):
+            lines.append(
+                f'{PREFIX}total{{route="{escape(route)}",'
+                f'method="{method}",status="{status}"}} {count}'
+            )
+    for metric, (description, buckets) in HISTOGRAMS.items():
+        name = PREFIX + metric
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for (route, method), histograms in sorted(routes.items()):
+            labels = f'route="{escape(route)}",method="{method}"'
+            values = histograms[metric]
+            for bound, count in zip(buckets, values):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {values[-2]}')
+            lines.append(f'{name}_count{{{labels}}} {values[-2]}')
+            lines.append(f'{name}_sum{{{labels}}} {values[-1]}')
+    return '\n'.join(lines) + '\n'
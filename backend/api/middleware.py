@@ -0,0 +1,45 @@
+from contextlib import ExitStack
+
+from django.db import connections
+
+from api import metrics
+
+
+class PerformanceMiddleware:
+    """
+    Measures SQL queries, serializers and total time of the request,
+    see api.metrics. Queries of streaming responses made after
+    the view has returned are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current.set(request_metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        request_metrics.execute_wrapper
+                    ))
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        observations = request_metrics.observations()
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={observations["db_duration_seconds"] * 1e3:.1f};'
+            f'desc="{observations["queries"]} queries"',
+            f'serialize;'
+            f'dur={observations["serialize_duration_seconds"] * 1e3:.1f}',
+            f'total;dur={observations["duration_seconds"] * 1e3:.1f}',
+        ))
+        match = request.resolver_match
+        metrics.registry.observe(
+            match.view_name if match else 'unmatched',
+            request.method,
+            response.status_code,
+            observations,
+        )
+        return response
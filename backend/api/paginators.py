@@ -1,5 +1,129 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (
+    Cursor,
+    CursorPagination,
+    PageNumberPagination,
+)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination. The next page starts after
+    the (ordering field, id) pair of the last row of the current page,
+    so the page is an index range scan without COUNT(*) and OFFSET.
+    Ordering is taken from cursor_ordering attribute of the view,
+    e.g. ('-created_at', '-id'), the second field must be unique.
+    Querysets ordered by something else, e.g. by search rank,
+    are not paginated by cursor: pages would change the order.
+    """
+    page_size_query_param = 'limit'
+    ordering = ('-created_at', '-id')
+    unsupported_ordering_message = (
+        'Cursor pagination is not available for this ordering, '
+        'use page parameter instead.'
+    )
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def _position_filter(self, model, position, ordering):
+        """Rows after position in the given ordering."""
+        key, unique = (field.lstrip('-') for field in ordering)
+        try:
+            value, unique_value = position.rsplit('|', 1)
+            value = model._meta.get_field(key).to_python(value)
+            unique_value = model._meta.get_field(unique).to_python(
+                unique_value
+            )
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        lookup = 'lt' if ordering[0].startswith('-') else 'gt'
+        # the first condition lets the database use
+        # the (key, unique) index as a range scan
+        return Q(**{f'{key}__{lookup}e': value}) & (
+            Q(**{f'{key}__{lookup}': value})
+            | Q(**{key: value, f'{unique}__{lookup}': unique_value})
+        )
+
+    def _position(self, obj):
+        key, unique = (field.lstrip('-') for field in self.ordering)
+        value = obj._meta.get_field(key).value_to_string(obj)
+        return f'{value}|{getattr(obj, unique)}'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        ordered_by = queryset.query.order_by
+        if ordered_by and ordered_by[0] != self.ordering[0]:
+            raise ValidationError(
+                {self.cursor_query_param: [self.unsupported_ordering_message]}
+            )
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = self.ordering
+        if reverse:
+            ordering = [self._invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None and self.cursor.position is not None:
+            queryset = queryset.filter(self._position_filter(
+                queryset.model, self.cursor.position, ordering
+            ))
+            came_from_page = True
+        else:
+            came_from_page = False
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = came_from_page, has_more
+        else:
+            self.has_next, self.has_previous = has_more, came_from_page
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False, position=self._position(self.page[-1])
+        ))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=True, position=self._position(self.page[0])
+        ))
 
 
 class CustomLimitPagination(PageNumberPagination):
+    """
+    Page number pagination with page size set by limit parameter.
+    If the client sends cursor parameter (empty for the first page),
+    keyset pagination is used instead, see KeysetPagination.
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_paginator = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset_paginator = KeysetPagination()
+            return self.keyset_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_html_context()
+        return super().get_html_context()
@@ -0,0 +1,250 @@
+"""
+Favorites, shopping carts and subscriptions of a user.
+
+A single relation is added by one INSERT which does nothing on conflict
+with the unique constraint and removed by one DELETE, the number of
+changed rows tells whether it existed, so concurrent requests
+do not fail with IntegrityError.
+Relations for many objects at once are inserted and deleted the same
+way by one statement. Statements return ids of the rows they changed
+(RETURNING), counters and the rest are changed only for them.
+
+Rows are changed without signals, counters of recipes and authors
+and state_version of the user (see recipes.signals and users.signals)
+are changed here with one UPDATE each.
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+
+from api import engagement
+from api.authentication import invalidate_user
+from recipes import feed, shopping_list
+from recipes.counters import change_recipe_counters, change_user_counters
+from recipes.models import Favorite, Recipe, RecipeCounterShard, ShoppingCart
+from users.models import Subscription
+
+User = get_user_model()
+
+# statuses of ids in results
+ADDED = 'added'
+ALREADY_ADDED = 'already_added'
+REMOVED = 'removed'
+NOT_ADDED = 'not_added'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+
+class Relation:
+    """Rows of model link the user to the objects of target model
+    by field."""
+
+    def __init__(self, model, field, target, change_counters,
+                 already_added, not_added):
+        self.model = model
+        self.field = field
+        self.target = target
+        self.change_counters = change_counters
+        # error messages of single relations
+        self.already_added = already_added
+        self.not_added = not_added
+
+    # error message if the relation is not allowed
+    not_allowed = None
+
+    def allowed(self, user, target_id):
+        return True
+
+    def _insert(self, user, target_ids):
+        """
+        INSERT ... SELECT of rows for existing targets, rows which
+        already exist are skipped on conflict. Returns ids of targets
+        whose rows were inserted by this statement: a concurrent
+        request inserting the same rows waits for the first one
+        and gets nothing back, so changes are counted once.
+        """
+        ops = connection.ops
+        # other fields get their defaults, as in Model.save()
+        other_fields = [
+            field for field in self.model._meta.concrete_fields
+            if not field.primary_key and field.name not in ('user', self.field)
+        ]
+        target_column = self.model._meta.get_field(self.field).column
+        columns = ', '.join(ops.quote_name(column) for column in (
+            'user_id', target_column, *(field.column for field in other_fields)
+        ))
+        target_pk = ops.quote_name(self.target._meta.pk.column)
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        with connection.cursor() as cursor:
+            # INSERT ... SELECT does nothing if the target
+            # has been deleted meanwhile
+            cursor.execute(
+                f'{ops.insert_statement(ignore_conflicts=True)} '
+                f'{ops.quote_name(self.model._meta.db_table)} ({columns}) '
+                f'SELECT %s, {target_pk}'
+                f'{", %s" * len(other_fields)} '
+                f'FROM {ops.quote_name(self.target._meta.db_table)} '
+                f'WHERE {target_pk} IN ({placeholders}) '
+                f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)} '
+                f'RETURNING {ops.quote_name(target_column)}',
+                [
+                    user.pk,
+                    *(field.get_db_prep_save(field.get_default(), connection)
+                      for field in other_fields),
+                    *target_ids,
+                ]
+            )
+            return [target_id for target_id, in cursor.fetchall()]
+
+    def _delete(self, user, target_ids):
+        """
+        DELETE ... RETURNING of rows of the user for target_ids.
+        Returns ids of targets whose rows were deleted by this statement,
+        a concurrent request deleting the same rows gets nothing back.
+        There are no rows referencing these models and rows are deleted
+        without signals (see the module docstring), so one statement
+        is enough.
+        """
+        ops = connection.ops
+        target_column = ops.quote_name(
+            self.model._meta.get_field(self.field).column
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {ops.quote_name(self.model._meta.db_table)} '
+                f'WHERE {ops.quote_name("user_id")} = %s '
+                f'AND {target_column} '
+                f'IN ({", ".join(["%s"] * len(target_ids))}) '
+                f'RETURNING {target_column}',
+                [user.pk, *target_ids]
+            )
+            return [target_id for target_id, in cursor.fetchall()]
+
+    def insert(self, user, target_id):
+        """Returns False if the relation already exists
+        or the target does not exist."""
+        inserted = self._insert(user, [target_id])
+        if inserted:
+            self.changed(user, inserted, 1)
+        return bool(inserted)
+
+    def delete(self, user, target_id):
+        """Returns False if there was no relation."""
+        deleted = self._delete(user, [target_id])
+        if deleted:
+            self.changed(user, deleted, -1)
+        return bool(deleted)
+
+    @transaction.atomic
+    def add(self, user, ids):
+        """Returns {id: status}."""
+        found = set(self.target.objects.filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        results = {}
+        new = []
+        for target_id in ids:
+            if target_id not in found:
+                results[target_id] = NOT_FOUND
+            elif not self.allowed(user, target_id):
+                results[target_id] = INVALID
+            else:
+                new.append(target_id)
+        if new:
+            # only rows inserted here are counted, rows added
+            # by a concurrent request are already added for this one
+            inserted = set(self._insert(user, new))
+            results.update(
+                (target_id, ADDED if target_id in inserted else ALREADY_ADDED)
+                for target_id in new
+            )
+            if inserted:
+                self.changed(user, list(inserted), 1)
+        return results
+
+    @transaction.atomic
+    def remove(self, user, ids):
+        """Returns {id: status}."""
+        deleted = set(self._delete(user, ids)) if ids else set()
+        if deleted:
+            self.changed(user, list(deleted), -1)
+        return {
+            target_id: REMOVED if target_id in deleted else NOT_ADDED
+            for target_id in ids
+        }
+
+    def changed(self, user, target_ids, delta):
+        self.change_counters(target_ids, delta)
+        User.objects.filter(pk=user.pk).update(
+            state_version=F('state_version') + 1
+        )
+        invalidate_user(user.pk)
+
+
+class EngagementRelation(Relation):
+    """Favorites and shopping carts also change the cached sets
+    of the user, see api.engagement."""
+
+    def __init__(self, name, *args):
+        super().__init__(*args)
+        self.name = name
+
+    def changed(self, user, target_ids, delta):
+        super().changed(user, target_ids, delta)
+        engagement.changed(user, self.name, target_ids, delta)
+
+
+class ShoppingCartRelation(EngagementRelation):
+    """Shopping carts also change the shopping list of the user,
+    see recipes.shopping_list."""
+
+    def changed(self, user, target_ids, delta):
+        super().changed(user, target_ids, delta)
+        if delta > 0:
+            shopping_list.add_recipes(user.pk, target_ids)
+        else:
+            shopping_list.remove_recipes(user.pk, target_ids)
+
+
+class SubscriptionRelation(Relation):
+    """Subscriptions also change the feed of the follower,
+    see recipes.feed."""
+    not_allowed = 'Can not subscribe to yourself'
+
+    def allowed(self, user, target_id):
+        return target_id != user.pk
+
+    def changed(self, user, target_ids, delta):
+        super().changed(user, target_ids, delta)
+        if delta > 0:
+            feed.follow(user.pk, target_ids)
+        else:
+            feed.unfollow(user.pk, target_ids)
+
+
+RELATIONS = {
+    'favorite': EngagementRelation(
+        'favorites', Favorite, 'recipe', Recipe,
+        lambda ids, delta: change_recipe_counters(
+            ids, RecipeCounterShard.FAVORITES, delta
+        ),
+        'Already in favorites',
+        'The recipe is not in favorites',
+    ),
+    'shopping_cart': ShoppingCartRelation(
+        'carts', ShoppingCart, 'recipe', Recipe,
+        lambda ids, delta: change_recipe_counters(
+            ids, RecipeCounterShard.CARTS, delta
+        ),
+        'The recipe is already in shopping cart',
+        'The recipe is not in shopping cart',
+    ),
+    'subscribe': SubscriptionRelation(
+        Subscription, 'author', User,
+        lambda ids, delta: change_user_counters(
+            ids, 'followers_count', delta
+        ),
+        'You are already subscribed to that author',
+        'Not subscribed',
+    ),
+}
@@ -1,21 +1,26 @@
 import base64
+import binascii
+import tempfile
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 
+from api import engagement
+from recipes import shopping_list
+from recipes.images import FORMATS, VARIANTS
 from recipes.models import (
     Recipe,
     Ingredient,
     Tag,
     RecipeIngredient,
     Favorite,
-    ShoppingCart
 )
 
-from users.models import Subscription
+from tasks.models import Task
 
 User = get_user_model()
 
@@ -46,6 +51,8 @@ class CustomUserRetrieveSerializer(UserSerializer):
         obj is the author (CustomUser instance).
         Anonymous user can not subscribe, so func returns False in this case.
         """
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         current_user = self.context.get('request').user
         return (current_user.is_authenticated
                 and obj.following.filter(user=current_user).exists())
@@ -63,14 +70,65 @@ class CustomUserRetrieveSerializer(UserSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Image as data URL.
+    Payload is decoded by chunks to a temporary file, which is kept
+    in memory only while it is small, so big images are not held
+    in memory twice. Normalization and thumbnails are done later
+    by a background task, see recipes.images.
+    """
+    CHUNK_SIZE = 64 * 1024  # multiple of 4, chunks are decoded separately
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            file = tempfile.SpooledTemporaryFile(
+                max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+            )
+            try:
+                for start in range(0, len(imgstr), self.CHUNK_SIZE):
+                    file.write(base64.b64decode(
+                        imgstr[start:start + self.CHUNK_SIZE]
+                    ))
+            except (binascii.Error, ValueError):
+                file.close()
+                self.fail('invalid_image')
+            file.seek(0)
+            data = File(file, name='temp.' + ext)
         return super().to_internal_value(data)
 
 
+class ImageVariantsField(serializers.Field):
+    """
+    URLs of thumbnails of the recipe image by size and format:
+    {"thumbnail": {"jpeg": url, "webp": url}, "medium": {...}}.
+    The original image is shown until thumbnails are generated.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        storage = recipe.image.storage
+        request = self.context.get('request')
+        original = recipe.image.name
+        urls = {}
+        for variant in VARIANTS:
+            names = recipe.image_variants.get(variant, {})
+            urls[variant] = {}
+            for image_format in FORMATS:
+                url = storage.url(names.get(image_format, original))
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[variant][image_format] = url
+        return urls
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
@@ -125,6 +183,10 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     ingredients = IngredientAmountSerializer(many=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False
+    )
     image = Base64ImageField()
     author = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
@@ -154,54 +216,128 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
         if ingredients:
-            RecipeIngredient.objects.filter(recipe=instance).delete()
-            self.__add_ingredients(instance, ingredients)
+            self.__update_ingredients(instance, ingredients)
         if tags:
             self.__add_tags(instance, tags)
         return super().update(instance, validated_data)
 
     def __add_ingredients(self, recipe, ingredients):
-        """Used by create method to add ingredients and amounts to recipe"""
+        """Used by create method to add ingredients and amounts to recipe.
+        Ingredients are checked by validate_ingredients."""
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount'],
             ) for ingredient in ingredients
         )
 
+    def __update_ingredients(self, recipe, ingredients):
+        """
+        Used by update method, only changed rows are written:
+        new ingredients are inserted and changed amounts are updated
+        by one query each, removed ingredients are deleted.
+        """
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe
+            ).only('id', 'ingredient_id', 'amount')
+        }
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        # shopping lists of users with the recipe in the cart
+        # are changed by the difference, bulk queries send no signals
+        deltas = {
+            ingredient_id: amount - (
+                existing[ingredient_id].amount
+                if ingredient_id in existing else 0
+            )
+            for ingredient_id, amount in amounts.items()
+        }
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            recipe_ingredient = existing.get(ingredient_id)
+            if recipe_ingredient and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        removed = [
+            recipe_ingredient.pk
+            for ingredient_id, recipe_ingredient in existing.items()
+            if ingredient_id not in amounts
+        ]
+        if removed:
+            # deleted with signals, receivers of RecipeIngredient
+            # remove the rows from shopping lists themselves
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amount,
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        )
+        shopping_list.change_recipe(recipe.pk, deltas)
+
     def __add_tags(self, recipe, tags):
         recipe.tags.set(tags)
 
     def to_representation(self, instance):
-        context = {'request': self.context.get('request')}
-        return RecipeListRetrieveSerializer(instance, context=context).data
+        """The recipe is read again with ingredients, tags and flags
+        of the current user in a few queries, instead of a query
+        for each ingredient."""
+        request = self.context.get('request')
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
+        return RecipeListRetrieveSerializer(
+            instance, context={'request': request}
+        ).data
 
     def validate_ingredients(self, value):
         if len(value) < 1:
             raise serializers.ValidationError(
                 'Ingredients should not be empty'
             )
-        unique_ingredients = []
+        ids = [ingredient['id'] for ingredient in value]
+        if len(ids) > len(set(ids)):
+            raise serializers.ValidationError('Ingredients must be unique')
         for ingredient in value:
-            unique_ingredients.append(ingredient['id'])
             if ingredient['amount'] < 1:
                 raise serializers.ValidationError(
                     'Amount of ingredient can not be less than 1'
                 )
-            if not Ingredient.objects.filter(pk=ingredient['id']).exists():
+        existing = set(Ingredient.objects.filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        for ingredient_id in ids:
+            if ingredient_id not in existing:
                 raise serializers.ValidationError(
-                    f'Ingredient with id {ingredient["id"]} does not exist'
+                    f'Ingredient with id {ingredient_id} does not exist'
                 )
-        if len(value) > len(set(unique_ingredients)):
-            raise serializers.ValidationError('Ingredients must be unique')
         return value
 
     def validate_tags(self, value):
+        """Returns tags found by one query."""
         unique_tags = set(value)
         if len(value) > len(unique_tags):
             raise serializers.ValidationError('Tags must be unique')
-        return value
+        tags = Tag.objects.in_bulk(unique_tags)
+        for tag_id in value:
+            if tag_id not in tags:
+                # the message of PrimaryKeyRelatedField used before
+                raise serializers.ValidationError(
+                    serializers.PrimaryKeyRelatedField.default_error_messages[
+                        'does_not_exist'
+                    ].format(pk_value=tag_id)
+                )
+        return [tags[tag_id] for tag_id in value]
 
     class Meta:
         model = Recipe
@@ -226,6 +362,7 @@ class RecipeListRetrieveSerializer(serializers.ModelSerializer):
     )
     tags = TagSerializer(many=True, read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
@@ -236,9 +373,11 @@ class RecipeListRetrieveSerializer(serializers.ModelSerializer):
           Anonymous user can not have favorites,
           so func returns False in this case.
           """
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         current_user = self.context.get('request').user
         return (current_user.is_authenticated
-                and obj.favorites.filter(user=current_user).exists())
+                and obj.pk in engagement.get_sets(current_user)['favorites'])
 
     def get_is_in_shopping_cart(self, obj):
         """
@@ -247,9 +386,11 @@ class RecipeListRetrieveSerializer(serializers.ModelSerializer):
            Anonymous user can not have anything in shopping cart,
            so func returns False in this case.
            """
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         current_user = self.context.get('request').user
         return (current_user.is_authenticated
-                and obj.carts.filter(user=current_user).exists())
+                and obj.pk in engagement.get_sets(current_user)['carts'])
 
     class Meta:
         model = Recipe
@@ -259,6 +400,7 @@ class RecipeListRetrieveSerializer(serializers.ModelSerializer):
             'text',
             'author',
             'image',
+            'image_variants',
             'ingredients',
             'tags',
             'cooking_time',
@@ -269,6 +411,7 @@ class RecipeListRetrieveSerializer(serializers.ModelSerializer):
 
 class RecipeShortListRetrieveSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -276,67 +419,46 @@ class RecipeShortListRetrieveSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
 
 
-class SubscriptionCreateDestroySerializer(serializers.ModelSerializer):
-    """Serialization and validation of subscriptions."""
-
-    def validate(self, data):
-        if self.context['request'].method == 'POST':
-            if data['user'] == data['author']:
-                raise serializers.ValidationError(
-                    'Can not subscribe to yourself'
-                )
-            if Subscription.objects.filter(
-                    user=data['user'],
-                    author=data['author']
-            ).exists():
-                raise serializers.ValidationError(
-                    'You are already subscribed to that author'
-                )
-            return data
-        if self.context['request'].method == 'DELETE':
-            if Subscription.objects.filter(
-                    user=data['user'],
-                    author=data['author']
-            ).exists():
-                return data
-            raise serializers.ValidationError(
-                'Not subscribed'
-            )
-
-    def to_representation(self, instance):
-        return SubscriptionRetrieveSerializer(instance['author'], context={
-            'request': self.context.get('request')
-        }).data
-
-    class Meta:
-        model = Subscription
-        fields = (
-            'user',
-            'author',
-        )
-
-
 class SubscriptionRetrieveSerializer(CustomUserRetrieveSerializer):
     """Provides information about the author and their recipes"""
     RECIPES_LIMIT = 10
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
-    def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes = Recipe.objects.filter(author=obj)
-        recipes_limit = request.GET.get('recipes_limit', self.RECIPES_LIMIT)
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
-            return RecipeShortListRetrieveSerializer(recipes, many=True).data
+    @classmethod
+    def get_recipes_limit(cls, request):
+        """Number of recipes to show for each author, 0 to hide them."""
+        recipes_limit = request.query_params.get(
+            'recipes_limit', cls.RECIPES_LIMIT
+        )
+        try:
+            return max(int(recipes_limit), 0)
+        except (TypeError, ValueError):
+            return cls.RECIPES_LIMIT
 
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+    def get_recipes(self, obj):
+        """
+        Recipes of the author.
+        If the serializer is used for a page of authors, the view puts
+        recipes of all authors into context, see
+        RecipeQuerySet.limited_per_author.
+        """
+        recipes = self.context.get('recipes')
+        if recipes is not None:
+            return RecipeShortListRetrieveSerializer(
+                recipes.get(obj.pk, []), many=True
+            ).data
+        recipes_limit = self.get_recipes_limit(self.context.get('request'))
+        recipes = Recipe.objects.filter(
+            author=obj
+        ).order_by('-created_at')[:recipes_limit]
+        return RecipeShortListRetrieveSerializer(recipes, many=True).data
 
     class Meta:
         model = User
@@ -396,46 +518,33 @@ class FavoriteSerializer(serializers.ModelSerializer):
         )
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
-    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
-
-    def to_representation(self, instance):
-        context = {'request': self.context.get('request')}
-        return RecipeShortListRetrieveSerializer(
-            instance['recipe'], context=context
-        ).data
-
-    def validate_recipe(self, value):
-        if Recipe.objects.filter(pk=value.id).exists():
-            return value
-        raise serializers.ValidationError(
-            f'Ingredient with id {value.id} does not exist'
-        )
-
-    def validate(self, data):
-        if self.context['request'].method == 'POST':
-            if ShoppingCart.objects.filter(
-                    user=data['user'],
-                    recipe=data['recipe']
-            ).exists():
-                raise serializers.ValidationError(
-                    'The recipe is already in shopping cart'
-                )
-            return data
-        if self.context['request'].method == 'DELETE':
-            if ShoppingCart.objects.filter(
-                    user=data['user'],
-                    recipe=data['recipe']
-            ).exists():
-                return data
-            raise serializers.ValidationError(
-                'The recipe is not in shopping cart'
-            )
+class TaskSerializer(serializers.ModelSerializer):
+    """Status of a background task, see tasks.queue."""
 
     class Meta:
-        model = ShoppingCart
+        model = Task
         fields = (
             'id',
-            'user',
-            'recipe'
+            'name',
+            'status',
+            'attempts',
+            'created_at',
+            'finished_at',
+            'result',
+            'error',
         )
+        read_only_fields = fields
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Ids of recipes or authors for bulk favorites, shopping carts
+    and subscriptions, see api.relations."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=200,
+    )
+
+    def validate_ids(self, value):
+        # repeated ids are processed once, order is kept
+        return list(dict.fromkeys(value))
@@ -0,0 +1,112 @@
+"""
+Shopping list of the user: ingredients of all recipes in the shopping cart
+with summed amounts (see recipes.shopping_list) rendered to the file
+chunk by chunk.
+"""
+import csv
+import json
+
+from django.db.models import ExpressionWrapper, F, FloatField, Sum
+
+from recipes import units
+from recipes.models import ShoppingCart, ShoppingListItem
+
+UNIT_FIELD = 'ingredient__measurement_unit'
+
+
+def get_shopping_list(user):
+    """
+    Returns products from shopping cart of the user with the amount
+    summed for each name in the canonical unit, see recipes.units:
+    sugar in grams and in kilograms is one row in grams.
+    total_amount is None for units without amounts, e.g. to taste.
+    """
+    return ShoppingListItem.objects.filter(user=user).values(
+        name=F('ingredient__name'),
+        measurement_unit=units.canonical_unit(UNIT_FIELD),
+    ).annotate(
+        total_amount=Sum(ExpressionWrapper(
+            F('amount') * units.factor(UNIT_FIELD),
+            output_field=FloatField(),
+        ))
+    ).order_by('name', 'measurement_unit')
+
+
+def get_summary(user):
+    """Shopping list of the user as a JSON object: products
+    in canonical units and the number of recipes in the cart."""
+    ingredients = [
+        {
+            'name': row['name'],
+            'measurement_unit': row['measurement_unit'],
+            'amount': format_amount(row['total_amount']),
+        }
+        for row in get_shopping_list(user)
+    ]
+    return {
+        'recipes_count': ShoppingCart.objects.filter(user=user).count(),
+        'ingredients_count': len(ingredients),
+        'ingredients': ingredients,
+    }
+
+
+def format_amount(amount):
+    """Sums of converted amounts are floats, 1250.0 is shown as 1250."""
+    if amount is None:
+        return None
+    amount = round(amount, 2)
+    return int(amount) if amount.is_integer() else amount
+
+
+class Echo:
+    """File-like object for csv.writer, returns the line instead of
+    writing it, so the line can be yielded."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(rows):
+    for row in rows:
+        amount = format_amount(row['total_amount'])
+        if amount is None:
+            yield (f'{row["name"].capitalize()} '
+                   f'({row["measurement_unit"]})\n')
+        else:
+            yield (f'{row["name"].capitalize()} '
+                   f'({row["measurement_unit"]}):  {amount}\n')
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow((
+            row['name'],
+            row['measurement_unit'],
+            format_amount(row['total_amount']),
+        ))
+
+
+def render_json(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(
+            {
+                'name': row['name'],
+                'measurement_unit': row['measurement_unit'],
+                'amount': format_amount(row['total_amount']),
+            },
+            ensure_ascii=False
+        )
+        separator = ','
+    yield ']'
+
+
+# file_format: (content type, renderer)
+FORMATS = {
+    'txt': ('text/plain', render_txt),
+    'csv': ('text/csv', render_csv),
+    'json': ('application/json', render_json),
+}
@@ -0,0 +1,100 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_token, invalidate_user
+from api.cache import invalidate_recipes
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Tag,
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def invalidate_after_commit(recipe_ids):
+    """Cache is invalidated when the changes are visible to other requests,
+    otherwise they could cache old data again."""
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: invalidate_recipes(recipe_ids))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    invalidate_after_commit([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def invalidate_recipe_ingredients(instance, **kwargs):
+    invalidate_after_commit([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_after_commit([instance.pk])
+    elif pk_set:
+        invalidate_after_commit(pk_set)
+    else:
+        invalidate_after_commit([])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def invalidate_tag(instance, **kwargs):
+    invalidate_after_commit(
+        instance.recipes.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_ingredient(instance, **kwargs):
+    invalidate_after_commit(
+        instance.recipes.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(instance, created, update_fields, **kwargs):
+    """Logins update last_login only, they do not change recipes."""
+    if created or (update_fields
+                   and not set(User.PUBLIC_FIELDS) & set(update_fields)):
+        return
+    invalidate_after_commit(
+        instance.recipes.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    """Logout."""
+    invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_token(instance, **kwargs):
+    """Password change, deactivation and other changes of the user."""
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Subscription)
+def invalidate_user_state(instance, **kwargs):
+    """state_version of the user is changed."""
+    invalidate_user(instance.user_id)
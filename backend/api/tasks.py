@@ -0,0 +1,58 @@
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from api import shopping_list
+from tasks.queue import task
+
+User = get_user_model()
+
+
+@task(max_attempts=2)
+def render_shopping_list(user_id, file_format):
+    """
+    Writes the shopping list of the user to a file in media storage.
+    The file is put into a random directory, so it can not be guessed
+    by other users, and is deleted after SHOPPING_LIST_FILE_TIMEOUT
+    seconds by delete_shopping_list task.
+    """
+    content_type, render = shopping_list.FORMATS[file_format]
+    rows = shopping_list.get_shopping_list(
+        User.objects.get(pk=user_id)
+    ).iterator()
+    with tempfile.TemporaryFile() as file:
+        for chunk in render(rows):
+            file.write(chunk.encode())
+        file.seek(0)
+        name = default_storage.save(
+            f'shopping_lists/{uuid.uuid4().hex}/shop_cart.{file_format}',
+            File(file)
+        )
+    expires_at = timezone.now() + timedelta(
+        seconds=getattr(settings, 'SHOPPING_LIST_FILE_TIMEOUT', 3600)
+    )
+    delete_shopping_list.enqueue(name, run_after=expires_at)
+    return {
+        'url': default_storage.url(name),
+        'content_type': content_type,
+        'expires_at': expires_at.isoformat(),
+    }
+
+
+@task()
+def delete_shopping_list(name):
+    """Deletes the file written by render_shopping_list
+    with its directory."""
+    default_storage.delete(name)
+    try:
+        os.rmdir(default_storage.path(os.path.dirname(name)))
+    except (NotImplementedError, FileNotFoundError):
+        # storages without directories, e.g. object storage
+        pass
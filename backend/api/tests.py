@@ -0,0 +1,493 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers, status
+from rest_framework.test import APITestCase
+
+from api import metrics
+from api.shopping_list import get_summary
+from api.management.commands.benchmark_counters import RECIPE_UPDATE
+from recipes import shopping_list
+from recipes.models import (
+    FeedItem,
+    Ingredient,
+    Recipe,
+    RecipeCounterShard,
+    RecipeIngredient,
+    ShoppingListItem,
+    Tag,
+)
+
+User = get_user_model()
+
+
+class RecipeFixtureMixin:
+    """Users, tags, ingredients and recipes shared by the tests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password',
+            first_name='User', last_name='User',
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Author', last_name='Author',
+        )
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+        cls.recipes = [cls.create_recipe(f'Рецепт {number}', {
+            cls.flour: 100 + number, cls.milk: 200,
+        }) for number in range(5)]
+        cls.recipe = cls.recipes[0]
+
+    @classmethod
+    def create_recipe(cls, name, amounts, author=None):
+        recipe = Recipe.objects.create(
+            name=name, text='Текст', author=author or cls.author,
+            image='recipes/test.jpg', cooking_time=10,
+        )
+        recipe.tags.set([cls.tag])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+    def setUp(self):
+        # versions in the cache outlive rolled back test transactions
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+
+class RecipeRetrieveTests(RecipeFixtureMixin, APITestCase):
+
+    def test_not_numeric_id(self):
+        for client_user in (self.user, None):
+            self.client.force_authenticate(client_user)
+            response = self.client.get('/api/recipes/abc/')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_id(self):
+        response = self.client.get('/api/recipes/999999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_authenticated_response_is_validated_by_etag_only(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('Authorization', response['Vary'])
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+        self.client.post(f'{url}favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_anonymous_response_has_last_modified(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('Authorization', response['Vary'])
+
+
+class RecipeReadQueriesTests(RecipeFixtureMixin, APITestCase):
+    """The number of queries does not depend on the number of recipes,
+    their tags and ingredients."""
+
+    def add_recipes(self):
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        for number in range(5):
+            recipe = self.create_recipe(f'Ещё рецепт {number}', {
+                self.flour: 50, self.milk: 100, sugar: 10,
+            })
+            recipe.tags.add(Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}',
+            ))
+        cache.clear()
+        # the user of a request is loaded by each request
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+    def test_list(self):
+        # page, count, tags, ingredients, authors with is_subscribed
+        # and the sets of favorites and shopping carts of the user
+        with self.assertNumQueries(7):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['count'], 5)
+        self.add_recipes()
+        with self.assertNumQueries(7):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.data['count'], 10)
+        recipe = response.data['results'][0]
+        self.assertEqual(len(recipe['tags']), 2)
+        self.assertEqual(
+            sorted(item['amount'] for item in recipe['ingredients']),
+            [10, 50, 100]
+        )
+
+    def test_retrieve(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        # updated_at for the ETag, recipe, tags, ingredients, author
+        # with is_subscribed and the sets of the user
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(
+            {item['id']: item['amount']
+             for item in response.data['ingredients']},
+            {self.flour.pk: 100, self.milk.pk: 200}
+        )
+        self.assertEqual(response.data['tags'][0]['slug'], 'breakfast')
+        self.assertFalse(response.data['is_favorited'])
+
+
+class ToggleRelationTests(RecipeFixtureMixin, APITestCase):
+
+    def urls(self):
+        return (
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            f'/api/users/{self.author.pk}/subscribe/',
+        )
+
+    def test_add_and_remove(self):
+        for url in self.urls():
+            response = self.client.post(url)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['id'], int(url.split('/')[3]))
+            self.assertEqual(self.client.delete(url).status_code,
+                             status.HTTP_204_NO_CONTENT)
+        self.assertFalse(self.user.favored.exists())
+        self.assertFalse(self.user.carts.exists())
+        self.assertFalse(self.user.follower.exists())
+
+    def test_duplicates_are_bad_requests(self):
+        for url in self.urls():
+            self.client.post(url)
+            response = self.client.post(url)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn('non_field_errors', response.data)
+            self.client.delete(url)
+            self.assertEqual(self.client.delete(url).status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertEqual(
+            Recipe.objects.with_counters().get(
+                pk=self.recipe.pk
+            ).favorites_total, 0
+        )
+
+    def test_missing_targets(self):
+        for url in ('/api/recipes/999999/favorite/',
+                    '/api/recipes/abc/shopping_cart/',
+                    '/api/users/999999/subscribe/'):
+            for method in (self.client.post, self.client.delete):
+                self.assertEqual(method(url).status_code,
+                                 status.HTTP_404_NOT_FOUND)
+
+    def test_subscribe_to_yourself(self):
+        response = self.client.post(f'/api/users/{self.user.pk}/subscribe/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.user.follower.exists())
+
+    def test_state_version_changes_only_with_rows(self):
+        url = self.urls()[0]
+        versions = []
+        for method in (self.client.post, self.client.post,
+                       self.client.delete, self.client.delete):
+            method(url)
+            versions.append(User.objects.get(pk=self.user.pk).state_version)
+        self.assertEqual(versions[0], versions[1])
+        self.assertEqual(versions[2], versions[3])
+        self.assertNotEqual(versions[1], versions[2])
+
+
+class FeedTests(RecipeFixtureMixin, APITestCase):
+
+    def feed(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['results']]
+
+    def newest_first(self, recipes):
+        return [recipe.pk for recipe in sorted(
+            recipes, key=lambda recipe: (recipe.created_at, recipe.pk),
+            reverse=True
+        )]
+
+    def test_subscribe_and_unsubscribe(self):
+        self.assertEqual(self.feed(), [])
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.client.post(url)
+        self.assertEqual(self.feed(), self.newest_first(self.recipes))
+        self.client.delete(url)
+        self.assertEqual(self.feed(), [])
+        self.assertFalse(FeedItem.objects.exists())
+
+    def test_new_recipe_is_fanned_out(self):
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        recipe = self.create_recipe('Новый рецепт', {self.flour: 1})
+        self.assertTrue(recipe.fanned_out)
+        self.assertTrue(FeedItem.objects.filter(
+            user=self.user, recipe=recipe
+        ).exists())
+        self.assertEqual(self.feed()[0], recipe.pk)
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_recipe_of_popular_author_is_pulled(self):
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        recipe = self.create_recipe('Новый рецепт', {self.flour: 1})
+        recipe.refresh_from_db()
+        self.assertFalse(recipe.fanned_out)
+        self.assertFalse(FeedItem.objects.filter(recipe=recipe).exists())
+        self.assertEqual(self.feed()[0], recipe.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.feed(), self.newest_first(
+                [*self.recipes, recipe]
+            ))
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if not query['sql'].lstrip().upper().startswith('SELECT')
+        ])
+
+
+class ShoppingListTests(RecipeFixtureMixin, APITestCase):
+    """Lists changed by deltas are compared with lists rebuilt
+    from the carts."""
+
+    def setUp(self):
+        super().setUp()
+        for recipe in self.recipes[:2]:
+            self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.client.force_authenticate(self.author)
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+
+    def items(self):
+        return {
+            (item.user_id, item.ingredient_id): item.amount
+            for item in ShoppingListItem.objects.all()
+        }
+
+    def assertRebuiltEqual(self, expected):
+        self.assertEqual(self.items(), expected)
+        shopping_list.rebuild()
+        self.assertEqual(self.items(), expected)
+
+    def test_carts(self):
+        self.assertRebuiltEqual({
+            (self.user.pk, self.flour.pk): 201,
+            (self.user.pk, self.milk.pk): 400,
+            (self.author.pk, self.flour.pk): 100,
+            (self.author.pk, self.milk.pk): 200,
+        })
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertRebuiltEqual({
+            (self.user.pk, self.flour.pk): 201,
+            (self.user.pk, self.milk.pk): 400,
+        })
+
+    def test_recipe_changes(self):
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {'ingredients': [
+                {'id': self.flour.pk, 'amount': 150},
+                {'id': sugar.pk, 'amount': 30},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRebuiltEqual({
+            (self.user.pk, self.flour.pk): 251,
+            (self.user.pk, self.milk.pk): 200,
+            (self.user.pk, sugar.pk): 30,
+            (self.author.pk, self.flour.pk): 150,
+            (self.author.pk, sugar.pk): 30,
+        })
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/')
+        self.assertRebuiltEqual({
+            (self.user.pk, self.flour.pk): 101,
+            (self.user.pk, self.milk.pk): 200,
+        })
+
+
+class ShoppingListSummaryTests(RecipeFixtureMixin, APITestCase):
+
+    def test_amounts_in_canonical_units(self):
+        products = {
+            ('сахар', 'г'): 100,
+            ('сахар', 'кг'): 1,
+            ('молоко', 'стакан'): 2,
+            ('молоко', 'л'): 1,
+            ('соль', 'по вкусу'): 1,
+            ('укроп', 'пучок'): 2,
+        }
+        recipe = self.create_recipe('Рецепт с единицами', {
+            Ingredient.objects.create(name=name, measurement_unit=unit):
+                amount
+            for (name, unit), amount in products.items()
+        })
+        for recipe_id in (recipe.pk, self.recipe.pk):
+            self.client.post(f'/api/recipes/{recipe_id}/shopping_cart/')
+        response = self.client.get('/api/recipes/shopping_cart_summary/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['recipes_count'], 2)
+        self.assertEqual(
+            {
+                (item['name'], item['measurement_unit']): item['amount']
+                for item in response.data['ingredients']
+            },
+            {
+                ('молоко', 'мл'): 1700,
+                ('мука', 'г'): 100,
+                ('сахар', 'г'): 1100,
+                ('соль', 'по вкусу'): None,
+                ('укроп', 'пучок'): 2,
+            }
+        )
+        self.assertEqual(response.data['ingredients_count'], 5)
+        # summed list and the number of recipes
+        with self.assertNumQueries(2):
+            get_summary(self.user)
+
+
+class KeysetPaginationTests(RecipeFixtureMixin, APITestCase):
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['results']]
+
+    def walk(self, url):
+        """ids of all pages by next links."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append(self.ids(response))
+            url = response.data['next']
+        return pages
+
+    def test_pages_do_not_overlap(self):
+        # recipes created at the same time are ordered by id
+        Recipe.objects.filter(pk__in=[
+            recipe.pk for recipe in self.recipes[1:4]
+        ]).update(created_at=self.recipe.created_at)
+        expected = list(Recipe.objects.order_by(
+            '-created_at', '-id'
+        ).values_list('pk', flat=True))
+        pages = self.walk('/api/recipes/?cursor=&limit=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_page(self):
+        first = self.client.get('/api/recipes/?cursor=&limit=2')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.ids(self.client.get(second.data['previous'])),
+                         self.ids(first))
+
+    def test_new_recipes_do_not_shift_pages(self):
+        first = self.client.get('/api/recipes/?cursor=&limit=2')
+        self.create_recipe('Новый рецепт', {self.flour: 1})
+        pages = self.walk(first.data['next'])
+        self.assertEqual(len(sum(pages, [])), 3)
+        self.assertFalse(set(self.ids(first)) & set(sum(pages, [])))
+
+    def test_search_is_not_paginated_by_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=&search=Рецепт')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cursor', response.data)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=abc')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_users(self):
+        pages = self.walk('/api/users/?cursor=&limit=1')
+        self.assertEqual(sum(pages, []), [self.user.pk, self.author.pk])
+
+
+class MetricsTests(RecipeFixtureMixin, APITestCase):
+
+    def serialize_time(self, response):
+        timings = dict(
+            item.strip().split(';dur=')
+            for item in response['Server-Timing'].split(',')
+            if 'desc=' not in item
+        )
+        return float(timings['serialize'])
+
+    def test_serializers_of_views_are_timed(self):
+        with mock.patch('time.perf_counter', side_effect=range(10 ** 6)):
+            self.assertGreater(self.serialize_time(
+                self.client.get('/api/recipes/')
+            ), 0)
+            self.assertGreater(self.serialize_time(
+                self.client.post(f'/api/recipes/{self.recipe.pk}/favorite/')
+            ), 0)
+
+    def test_serializer_classes_are_not_changed(self):
+        for serializer_class in (serializers.Serializer,
+                                 serializers.ListSerializer):
+            self.assertEqual(serializer_class.data.fget.__module__,
+                             'rest_framework.serializers')
+        serializer_class = metrics.timed(serializers.Serializer)
+        self.assertIs(metrics.timed(serializers.Serializer),
+                      serializer_class)
+        self.assertTrue(issubclass(serializer_class, serializers.Serializer))
+
+
+class RecipeCounterTests(RecipeFixtureMixin, APITestCase):
+
+    def toggle(self):
+        """Returns the number of UPDATEs of the recipe row."""
+        with CaptureQueriesContext(connection) as queries:
+            for relation in ('favorite', 'shopping_cart'):
+                url = f'/api/recipes/{self.recipe.pk}/{relation}/'
+                self.assertEqual(self.client.post(url).status_code,
+                                 status.HTTP_201_CREATED)
+                self.assertEqual(self.client.delete(url).status_code,
+                                 status.HTTP_204_NO_CONTENT)
+                self.client.post(url)
+        return sum(
+            bool(RECIPE_UPDATE.match(query['sql']))
+            for query in queries.captured_queries
+        )
+
+    def counters(self):
+        recipe = Recipe.objects.with_counters().get(pk=self.recipe.pk)
+        return recipe.favorites_total, recipe.carts_total
+
+    def test_counters(self):
+        self.assertEqual(self.toggle(), 6)
+        self.assertEqual(self.counters(), (1, 1))
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.favorites_count, self.recipe.carts_count), (1, 1)
+        )
+
+    @override_settings(RECIPE_COUNTER_SHARDS=4)
+    def test_sharded_counters_do_not_update_recipe(self):
+        self.assertEqual(self.toggle(), 0)
+        self.assertEqual(self.counters(), (1, 1))
+        self.assertTrue(RecipeCounterShard.objects.filter(
+            recipe=self.recipe
+        ).exists())
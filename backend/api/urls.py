@@ -5,7 +5,9 @@ from api.views import (
     RecipeViewSet,
     TagViewSet,
     IngredientViewSet,
-    CustomUserViewSet
+    CustomUserViewSet,
+    MetricsView,
+    TaskViewSet,
 )
 
 app_name = 'api'
@@ -15,8 +17,10 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('tags', TagViewSet, basename='tags')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('users', CustomUserViewSet)
+router.register('tasks', TaskViewSet, basename='tasks')
 
 urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
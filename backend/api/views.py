@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import BooleanField, Value
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from djoser.views import UserViewSet
 
 from django_filters.rest_framework import DjangoFilterBackend
@@ -8,39 +12,45 @@ from rest_framework import (
     viewsets,
     permissions,
     status,
-    mixins
+    mixins,
+    serializers,
 )
 from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
 from recipes.models import (
     Recipe,
     Ingredient,
-    RecipeIngredient,
     Tag,
     Favorite,
-    ShoppingCart,
 )
+from recipes import feed
+from recipes.ingredient_index import ingredient_index
+from tasks.models import Task
 from users.models import (
-    Subscription,
     CustomUser,
 )
 from api.serializers import (
     RecipeListRetrieveSerializer,
+    RecipeShortListRetrieveSerializer,
     RecipeCreateSerializer,
     IngredientSerializer,
     TagSerializer,
-    SubscriptionCreateDestroySerializer,
     SubscriptionRetrieveSerializer,
     CustomUserRetrieveSerializer,
     FavoriteSerializer,
-    ShoppingCartSerializer,
+    TaskSerializer,
+    BulkIdsSerializer,
 )
 from api.my_permissions import (
     IsAuthorOrReadOnly,
     IsAdminOrReadOnly,
 )
 from api.filters import (
+    RECIPE_ORDERINGS,
     RecipeFilter,
     IngredientFilter,
 )
@@ -48,13 +58,64 @@ from api.filters import (
 from api.paginators import (
     CustomLimitPagination,
 )
+from api import cache, conditional, metrics, relations, shopping_list
+from api.tasks import render_shopping_list
 
 User = get_user_model()
 
 
-class CustomUserViewSet(UserViewSet):
+def toggle_relation(request, name, pk, represent):
+    """
+    POST adds and DELETE removes the favorite, shopping cart or
+    subscription of the current user by one statement,
+    see api.relations. POST responds with represent(target).
+    """
+    relation = relations.RELATIONS[name]
+    try:
+        target_id = int(pk)
+    except ValueError:
+        raise Http404
+    if request.method == 'POST':
+        target = get_object_or_404(relation.target, pk=target_id)
+        if not relation.allowed(request.user, target_id):
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [relation.not_allowed]}
+            )
+        if not relation.insert(request.user, target_id):
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [relation.already_added]}
+            )
+        return Response(represent(target), status=status.HTTP_201_CREATED)
+    if relation.delete(request.user, target_id):
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    get_object_or_404(relation.target, pk=target_id)
+    raise serializers.ValidationError(
+        {api_settings.NON_FIELD_ERRORS_KEY: [relation.not_added]}
+    )
+
+
+def bulk_relation(request, name):
+    """POST adds and DELETE removes favorites, shopping carts or
+    subscriptions for all ids of the request body, the response has
+    the status of each id, see api.relations."""
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    relation = relations.RELATIONS[name]
+    ids = serializer.validated_data['ids']
+    if request.method == 'POST':
+        statuses = relation.add(request.user, ids)
+    else:
+        statuses = relation.remove(request.user, ids)
+    return Response({'results': [
+        {'id': target_id, 'status': statuses[target_id]}
+        for target_id in ids
+    ]})
+
+
+class CustomUserViewSet(metrics.TimedSerializersMixin, UserViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     pagination_class = CustomLimitPagination
+    cursor_ordering = ('date_joined', 'id')
 
     def get_serializer_class(self):
         if (self.request.method in permissions.SAFE_METHODS
@@ -78,31 +139,25 @@ class CustomUserViewSet(UserViewSet):
         detail=True,
         permission_classes=[permissions.IsAuthenticatedOrReadOnly],
     )
+    @transaction.atomic
     def subscribe(self, request, id):
-        user = request.user
-        author = get_object_or_404(User, id=id)
-        serializer = SubscriptionCreateDestroySerializer(
-            data={
-                'user': user.pk,
-                'author': author.pk
-            },
-            context={'request': request}
-        )
+        def represent(author):
+            author.is_subscribed = True
+            return metrics.timed(SubscriptionRetrieveSerializer)(
+                author, context={'request': request}
+            ).data
+        return toggle_relation(request, 'subscribe', id, represent)
 
-        if request.method == 'POST':
-            if serializer.is_valid(raise_exception=True):
-                Subscription.objects.create(user=user, author=author)
-                return Response(
-                    data=serializer.data,
-                    status=status.HTTP_201_CREATED
-                )
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-
-        if request.method == 'DELETE':
-            if serializer.is_valid(raise_exception=True):
-                Subscription.objects.get(user=user, author=author).delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        url_path='subscribe',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def subscribe_bulk(self, request):
+        """Subscribes to or unsubscribes from several authors,
+        body is {"ids": [author ids]}."""
+        return bulk_relation(request, 'subscribe')
 
     @action(
         methods=['GET'],
@@ -112,32 +167,107 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        authors = CustomUser.objects.filter(following__user=user)
+        authors = CustomUser.objects.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         page = self.paginate_queryset(authors)
         if page:
-            serializer = SubscriptionRetrieveSerializer(
+            recipes = Recipe.objects.limited_per_author(
+                page,
+                SubscriptionRetrieveSerializer.get_recipes_limit(request)
+            )
+            serializer = metrics.timed(SubscriptionRetrieveSerializer)(
                 page,
                 many=True,
-                context={'request': request}
+                context={'request': request, 'recipes': recipes}
             )
             return self.get_paginated_response(serializer.data)
         else:
             return Response(status=status.HTTP_200_OK)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(metrics.TimedSerializersMixin,
+                    viewsets.ModelViewSet):
     """CRUD for recipes"""
     queryset = Recipe.objects.all().order_by('-created_at')
     permission_classes = [IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
     pagination_class = CustomLimitPagination
+    cursor_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # flags and related objects are loaded by a fixed number
+            # of queries, serializers read the annotations
+            queryset = queryset.with_related().with_user_flags(
+                self.request.user
+            )
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return RecipeListRetrieveSerializer
         return RecipeCreateSerializer
 
+    def list(self, request, *args, **kwargs):
+        """Responses for anonymous users are the same for everyone,
+        they are cached, see api.cache."""
+        self.cursor_ordering = RECIPE_ORDERINGS.get(
+            request.query_params.get('ordering'), self.cursor_ordering
+        )
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        list_recipes = super().list
+        return Response(cache.get_recipe_list(
+            request, lambda: list_recipes(request, *args, **kwargs).data
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Responses have ETag made of the time the recipe was changed
+        and the version of favorites, carts and subscriptions
+        of the current user, so If-None-Match costs one query.
+        Responses for anonymous users are cached, see api.cache.
+        """
+        retrieve_recipe = super().retrieve
+        try:
+            pk = int(kwargs[self.lookup_field])
+        except (TypeError, ValueError):
+            # not an id, the view returns 404
+            return retrieve_recipe(request, *args, **kwargs)
+        updated_at = Recipe.objects.filter(pk=pk).values_list(
+            'updated_at', flat=True
+        ).first()
+        if request.user.is_authenticated:
+            user_state = (request.user.pk, request.user.state_version)
+
+            def get_response():
+                return retrieve_recipe(request, *args, **kwargs)
+        else:
+            user_state = None
+
+            def get_response():
+                return Response(cache.get_recipe(
+                    request,
+                    pk,
+                    lambda: retrieve_recipe(request, *args, **kwargs).data
+                ))
+        if updated_at is None:
+            # not found, the view returns the error
+            return get_response()
+        # flags of the user change without changing the recipe,
+        # so only ETag can validate responses for authenticated users
+        response = conditional.conditional_response(
+            request,
+            conditional.make_etag('recipe', pk, updated_at, user_state),
+            updated_at if user_state is None else None,
+            get_response
+        )
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -145,62 +275,74 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=['POST', 'DELETE'],
         detail=True,
         permission_classes=[permissions.IsAuthenticated],
-        serializer_class=FavoriteSerializer
     )
+    @transaction.atomic
     def favorite(self, request, pk):
-        user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        serializer = FavoriteSerializer(
-            data={'recipe': recipe.pk},
-            context={'request': request}
+        return toggle_relation(
+            request, 'favorite', pk, self.represent_short
         )
-        if request.method == 'POST':
-            if serializer.is_valid(raise_exception=True):
-                Favorite.objects.create(user=user, recipe=recipe)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
-        if request.method == 'DELETE':
-            if serializer.is_valid(raise_exception=True):
-                Favorite.objects.get(user=user, recipe=recipe).delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST
-            )
 
     @action(
         methods=['POST', 'DELETE'],
         detail=True,
         permission_classes=[IsAuthorOrReadOnly],
-        serializer_class=ShoppingCartSerializer
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk):
-        user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        serializer = ShoppingCartSerializer(
-            data={'recipe': recipe.pk},
-            context={'request': request}
+        return toggle_relation(
+            request, 'shopping_cart', pk, self.represent_short
         )
 
-        if request.method == 'POST':
-            if serializer.is_valid(raise_exception=True):
-                ShoppingCart.objects.create(user=user, recipe=recipe)
-                return Response(
-                    serializer.data,
-                    status=status.HTTP_201_CREATED
-                )
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    def represent_short(self, recipe):
+        return metrics.timed(RecipeShortListRetrieveSerializer)(
+            recipe, context={'request': self.request}
+        ).data
 
-        if request.method == 'DELETE':
-            if serializer.is_valid(raise_exception=True):
-                ShoppingCart.objects.get(user=user, recipe=recipe).delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        url_path='favorite',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def favorite_bulk(self, request):
+        """Adds or removes several favorites,
+        body is {"ids": [recipe ids]}."""
+        return bulk_relation(request, 'favorite')
+
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        url_path='shopping_cart',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def shopping_cart_bulk(self, request):
+        """Adds or removes several recipes of the shopping cart,
+        body is {"ids": [recipe ids]}."""
+        return bulk_relation(request, 'shopping_cart')
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def feed(self, request):
+        """
+        Recipes of the authors the user is subscribed to, newest first,
+        see recipes.feed. The page of feed items is one range scan
+        of the index, then recipes of the page are loaded by ids.
+        """
+        self.cursor_ordering = ('-created_at', '-recipe_id')
+        items = self.paginate_queryset(feed.get_feed(request.user))
+        recipes = self.get_queryset().with_related().with_user_flags(
+            request.user
+        ).in_bulk([item.recipe_id for item in items])
+        serializer = metrics.timed(RecipeListRetrieveSerializer)(
+            [recipes[item.recipe_id] for item in items
+             if item.recipe_id in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
 
     @action(
         methods=['GET'],
@@ -208,42 +350,59 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def download_shopping_cart(self, request):
-        shopping_cart_ingredients = RecipeIngredient.objects.filter(
-            recipe__carts__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit',
-            'amount'
-        )
-        text = []
-        shopping_cart_summed_ingredients = {}
-        for el in shopping_cart_ingredients:
-            name = el.get('ingredient__name')
-            unit = el.get("ingredient__measurement_unit")
-            amount = el.get('amount')
-            if (
-                    el.get('ingredient__name') not in
-                    shopping_cart_summed_ingredients.keys()
-            ):
-                shopping_cart_summed_ingredients[name] = {
-                    'unit': unit, 'amount': amount
-                }
-            else:
-                shopping_cart_summed_ingredients[name]['amount'] += amount
-        for key, value in shopping_cart_summed_ingredients.items():
-            text.append(
-                f'{key.capitalize()} ({value["unit"]}):  {value["amount"]}\n'
+        """
+        Streams the shopping list as txt (default), csv or json file,
+        format is chosen by file_format query parameter.
+        Ingredients are summed by the database and written to the response
+        row by row, so memory usage does not depend on the size of the cart.
+        With background=true the file is prepared by a background task,
+        the response is 202 with the task, its result contains the URL
+        of the file when it is done. The file is deleted after
+        SHOPPING_LIST_FILE_TIMEOUT seconds.
+        """
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in shopping_list.FORMATS:
+            return Response(
+                {'file_format': [
+                    f'Available formats: {", ".join(shopping_list.FORMATS)}'
+                ]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.query_params.get('background') in ('true', '1'):
+            task = render_shopping_list.enqueue(
+                request.user.pk, file_format, user=request.user
             )
-        return HttpResponse(
-            text,
+            return Response(
+                metrics.timed(TaskSerializer)(task).data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': reverse(
+                    'api:tasks-detail', args=(task.pk,)
+                )}
+            )
+        content_type, render = shopping_list.FORMATS[file_format]
+        rows = shopping_list.get_shopping_list(request.user).iterator()
+        return StreamingHttpResponse(
+            render(rows),
             headers={
-                'Content-Type': 'text/plain',
-                'Content-Disposition': 'attachment; filename="shop_cart.txt"'
+                'Content-Type': f'{content_type}; charset=utf-8',
+                'Content-Disposition':
+                    f'attachment; filename="shop_cart.{file_format}"'
             }
         )
 
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    def shopping_cart_summary(self, request):
+        """Shopping list as JSON: amounts of each product summed
+        in its canonical unit (see recipes.units) by one query."""
+        return Response(shopping_list.get_summary(request.user))
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(metrics.TimedSerializersMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Get a single or all ingredients. Readolny."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -252,8 +411,38 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        """
+        Search by name prefix (autocomplete, name parameter)
+        and typo-tolerant search (search parameter) are served
+        by the in-memory index without database queries.
+        """
+        return conditional.table_response(
+            request,
+            'ingredient',
+            lambda: self._list(request, *args, **kwargs)
+        )
+
+    def _list(self, request, *args, **kwargs):
+        search = request.query_params.get('search')
+        if search is not None:
+            return Response(ingredient_index.search(search))
+        name = request.query_params.get('name')
+        if name is not None:
+            return Response(ingredient_index.startswith(name))
+        return super().list(request, *args, **kwargs)
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    def retrieve(self, request, *args, **kwargs):
+        retrieve_ingredient = super().retrieve
+        return conditional.table_response(
+            request,
+            'ingredient',
+            lambda: retrieve_ingredient(request, *args, **kwargs)
+        )
+
+
+class TagViewSet(metrics.TimedSerializersMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """Get a single or all tags. Readolny.
     Used to assign tags to recipes."""
     queryset = Tag.objects.all()
@@ -261,10 +450,56 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        list_tags = super().list
+        return conditional.table_response(
+            request, 'tag', lambda: list_tags(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        retrieve_tag = super().retrieve
+        return conditional.table_response(
+            request, 'tag', lambda: retrieve_tag(request, *args, **kwargs)
+        )
+
+
+class TaskViewSet(metrics.TimedSerializersMixin,
+                  mixins.RetrieveModelMixin,
+                  viewsets.GenericViewSet):
+    """Status of a background task started by the current user."""
+    serializer_class = TaskSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Task.objects.filter(user=self.request.user)
+
 
-class FavoriteViewSet(mixins.CreateModelMixin,
+class FavoriteViewSet(metrics.TimedSerializersMixin,
+                      mixins.CreateModelMixin,
                       mixins.DestroyModelMixin,
                       viewsets.GenericViewSet):
     queryset = Favorite.objects.all()
     serializer_class = FavoriteSerializer
     permission_classes = [IsAuthorOrReadOnly]
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # errors, e.g. for not staff users
+        return str(data).encode(self.charset)
+
+
+class MetricsView(APIView):
+    """Histograms of requests by route in Prometheus text format,
+    see api.metrics."""
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        return Response(metrics.render_prometheus(metrics.collect()))
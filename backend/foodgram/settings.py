@@ -28,10 +28,12 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'api.apps.ApiConfig',
     'recipes.apps.RecipesConfig',
+    'tasks.apps.TasksConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,6 +81,31 @@ else:
         }
     }
 
+# The cache is shared by backend, worker and popularity containers:
+# versions changed by one process must be seen by the others
+# and single-flight locks of api.cache need an atomic cache.add(),
+# so memcached is used, FileBasedCache has neither.
+# The development server is a single process.
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': os.getenv(
+                'CACHE_BACKEND',
+                'django.core.cache.backends.memcached.PyMemcacheCache'
+            ),
+            'LOCATION': os.getenv('CACHE_LOCATION', 'cache:11211'),
+        }
+    }
+
+# Seconds to keep responses for anonymous users, see api.cache
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 300))
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -98,7 +125,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -135,3 +162,33 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Number of shards for favorites and shopping cart counters of recipes,
+# 0 to change counters of the recipe row directly, see recipes.counters
+RECIPE_COUNTER_SHARDS = int(os.getenv('RECIPE_COUNTER_SHARDS', 0))
+
+# Recipes of authors with more followers are not added to the feeds
+# of followers on write, followers pull them on read, see recipes.feed
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 5000))
+
+# Favorites and shopping carts lose half of their weight in popularity
+# of recipes every this many days, see recipes.popularity
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv('POPULARITY_HALF_LIFE_DAYS', 7))
+
+# Tokens and their users are kept in the cache for this many seconds,
+# see api.authentication
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 60))
+
+# Background tasks, see tasks.queue
+# seconds after which a running task is considered lost and taken again
+TASKS_TIMEOUT = int(os.getenv('TASKS_TIMEOUT', 600))
+# delay before the first retry of a failed task, doubled for next ones
+TASKS_RETRY_DELAY = int(os.getenv('TASKS_RETRY_DELAY', 10))
+# seconds to keep shopping lists rendered in background, see api.tasks
+SHOPPING_LIST_FILE_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_FILE_TIMEOUT', 3600)
+)
+
+# Request metrics of a worker are written to the cache
+# at most every so many seconds, see api.metrics
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 10))
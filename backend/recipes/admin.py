@@ -32,13 +32,23 @@ class IngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [IngredientInline]
-    list_display = ('pk', 'name', 'author', 'favorite_count')
+    list_display = (
+        'pk', 'name', 'author', 'favorite_count', 'cart_count'
+    )
     list_editable = ('name', 'author',)
     list_filter = ('name', 'author', 'tags')
     empty_value_display = '-empty-'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_counters()
+
+    @admin.display(ordering='favorites_total')
     def favorite_count(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_total
+
+    @admin.display(ordering='carts_total')
+    def cart_count(self, obj):
+        return obj.carts_total
 
 
 @admin.register(RecipeIngredient)
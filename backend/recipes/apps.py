@@ -5,3 +5,6 @@ class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
     verbose_name = 'Manage recipes'
+
+    def ready(self):
+        import recipes.signals  # noqa: F401
@@ -0,0 +1,70 @@
+"""
+Denormalized counters of recipes and users.
+
+Counters are changed with F() expressions by signals (recipes.signals,
+users.signals) in the transaction which creates or deletes the row,
+including cascade deletes. Bulk operations do not send signals,
+reconcile_counters command fixes the drift.
+
+If RECIPE_COUNTER_SHARDS setting is greater than 1, changes of recipe
+counters go to one of RECIPE_COUNTER_SHARDS random RecipeCounterShard
+rows instead of the recipe row. The current value is then
+the counter of the recipe plus deltas of its shards,
+see RecipeQuerySet.with_counters. Favorites and shopping carts then
+do not write the recipe row at all, concurrent requests for a popular
+recipe wait only for each other's shard. benchmark_counters command
+measures it and checks that the row is not updated.
+"""
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils import timezone
+
+from recipes.models import Recipe, RecipeCounterShard
+
+User = get_user_model()
+
+
+def change_recipe_counter(recipe_id, counter, delta):
+    """counter is RecipeCounterShard.FAVORITES or RecipeCounterShard.CARTS"""
+    shards = getattr(settings, 'RECIPE_COUNTER_SHARDS', 0)
+    if shards > 1:
+        shard, created = RecipeCounterShard.objects.get_or_create(
+            recipe_id=recipe_id,
+            counter=counter,
+            shard=random.randrange(shards),
+            defaults={'delta': delta},
+        )
+        if not created:
+            RecipeCounterShard.objects.filter(pk=shard.pk).update(
+                delta=F('delta') + delta, updated_at=timezone.now()
+            )
+        return
+    field = f'{counter}_count'
+    Recipe.objects.filter(pk=recipe_id).update(
+        **{field: F(field) + delta}, counters_updated_at=timezone.now()
+    )
+
+
+def change_recipe_counters(recipe_ids, counter, delta):
+    """Changes the counter of several recipes,
+    used by bulk operations which do not send signals."""
+    if getattr(settings, 'RECIPE_COUNTER_SHARDS', 0) > 1:
+        for recipe_id in recipe_ids:
+            change_recipe_counter(recipe_id, counter, delta)
+        return
+    field = f'{counter}_count'
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        **{field: F(field) + delta}, counters_updated_at=timezone.now()
+    )
+
+
+def change_user_counter(user_id, field, delta):
+    """field is 'recipes_count' or 'followers_count'"""
+    change_user_counters([user_id], field, delta)
+
+
+def change_user_counters(user_ids, field, delta):
+    User.objects.filter(pk__in=user_ids).update(**{field: F(field) + delta})
@@ -0,0 +1,162 @@
+"""
+Feed of recipes of the authors a user is subscribed to.
+
+The feed is materialized in FeedItem table (fan-out on write): a new
+recipe is added to the feeds of all followers of its author, subscribing
+adds the recipes of the author to the feed of the follower and
+unsubscribing removes them. Rows are inserted by INSERT ... SELECT,
+they are not loaded to Python.
+
+Recipes of authors with more than FEED_FANOUT_LIMIT followers are not
+added on write, one recipe would insert too many rows. The choice is
+made when the recipe is created and stored in Recipe.fanned_out, so it
+does not change with the number of followers later. Followers pull
+recipes which were not fanned out into their own feeds when they read
+it (fan-out on read), see pull. Reading does not write unless there are
+such recipes missing from the feed.
+Reading a page of the feed is a range scan of feed_user_created_at_idx.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.contrib.auth import get_user_model
+from django.db.models import (
+    DateTimeField,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Value,
+)
+from django.utils import timezone
+
+from recipes.models import FeedItem, Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+# recipes are committed some time after created_at is set,
+# pull looks this far back from the previous pull
+PULL_OVERLAP = timedelta(minutes=5)
+
+
+def fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_LIMIT', 5000)
+
+
+def insert(queryset, columns):
+    """
+    INSERT INTO feed (columns) SELECT ... of the queryset,
+    rows already in the feed are skipped.
+    Columns of values() queryset are its fields followed by annotations.
+    """
+    ops = connection.ops
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{ops.insert_statement(ignore_conflicts=True)} '
+            f'{ops.quote_name(FeedItem._meta.db_table)} '
+            f'({", ".join(ops.quote_name(column) for column in columns)}) '
+            f'{sql} {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+            params
+        )
+        return cursor.rowcount
+
+
+def recipes_of(authors, follower):
+    """Rows of the feed of follower for recipes of authors queryset."""
+    return insert(
+        Recipe.objects.filter(author__in=authors).annotate(
+            follower=Value(follower, output_field=IntegerField())
+        ).values('id', 'author_id', 'created_at', 'follower'),
+        ('recipe_id', 'author_id', 'created_at', 'user_id')
+    )
+
+
+def fan_out(recipe):
+    """Adds the new recipe to the feeds of followers of its author
+    unless the author is too popular, then the recipe is marked
+    to be pulled by the followers."""
+    followers_count = User.objects.filter(pk=recipe.author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if followers_count is not None and followers_count > fanout_limit():
+        Recipe.objects.filter(pk=recipe.pk).update(fanned_out=False)
+        recipe.fanned_out = False
+        return 0
+    return insert(
+        Subscription.objects.filter(author=recipe.author_id).annotate(
+            recipe=Value(recipe.pk, output_field=IntegerField()),
+            created_at=Value(recipe.created_at, output_field=DateTimeField()),
+        ).values('user_id', 'author_id', 'recipe', 'created_at'),
+        ('user_id', 'author_id', 'recipe_id', 'created_at')
+    )
+
+
+def follow(user_id, author_ids):
+    """Adds recipes of the authors to the feed of the new follower."""
+    Subscription.objects.filter(
+        user=user_id, author__in=author_ids
+    ).update(feed_synced_at=timezone.now())
+    return recipes_of(author_ids, user_id)
+
+
+def unfollow(user_id, author_ids):
+    FeedItem.objects.filter(user=user_id, author__in=author_ids).delete()
+
+
+def missing(user):
+    """Recipes which were not fanned out, created since the previous
+    pull from their authors and not in the feed of the user yet."""
+    return Recipe.objects.filter(
+        fanned_out=False,
+        author__following__user=user,
+        created_at__gt=F('author__following__feed_synced_at') - PULL_OVERLAP,
+    ).exclude(
+        Exists(FeedItem.objects.filter(user=user, recipe=OuterRef('pk')))
+    )
+
+
+def pull(user):
+    """Adds recipes of popular authors which are missing from the feed
+    of the user. Nothing is written if there are none."""
+    now = timezone.now()
+    recipes = missing(user)
+    author_ids = list(
+        recipes.values_list('author_id', flat=True).order_by().distinct()
+    )
+    if not author_ids:
+        return 0
+    pulled = insert(
+        recipes.annotate(
+            follower=Value(user.pk, output_field=IntegerField())
+        ).values('id', 'author_id', 'created_at', 'follower'),
+        ('recipe_id', 'author_id', 'created_at', 'user_id')
+    )
+    Subscription.objects.filter(
+        user=user, author__in=author_ids
+    ).update(feed_synced_at=now)
+    return pulled
+
+
+def get_feed(user):
+    """Feed items of the user, newest first."""
+    pull(user)
+    return FeedItem.objects.filter(user=user).order_by(
+        '-created_at', '-recipe_id'
+    )
+
+
+def rebuild():
+    """Fills the feeds of all users from subscriptions, used after
+    bulk imports which do not send signals."""
+    FeedItem.objects.all().delete()
+    Subscription.objects.update(feed_synced_at=timezone.now())
+    return insert(
+        Recipe.objects.filter(author__following__isnull=False).values(
+            'id', 'author_id', 'created_at',
+            follower=F('author__following__user'),
+        ),
+        ('recipe_id', 'author_id', 'created_at', 'user_id')
+    )
@@ -0,0 +1,163 @@
+"""
+Processing of recipe images outside of the request.
+
+Uploads are saved as they are and the recipe gets empty image_variants.
+Such recipes are processed by a background task (see recipes.tasks)
+or by process_images command for images uploaded before. The image
+is replaced with a normalized copy (orientation from EXIF applied,
+metadata stripped, size limited, JPEG) and fixed-size variants
+in JPEG and WebP are saved next to it. Until the recipe is processed
+serializers fall back to the original image.
+"""
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+ORIGINAL_MAX_SIZE = (1920, 1920)
+# name: (width, height), images are cropped to fill the size
+VARIANTS = {
+    'thumbnail': (360, 240),
+    'medium': (960, 640),
+}
+FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+VARIANTS_DIR = 'recipes/variants'
+BACKGROUND = (255, 255, 255)
+
+
+def normalize(image):
+    """
+    Applies orientation from EXIF and flattens transparency,
+    so the image can be saved as JPEG without metadata.
+    """
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        flat = Image.new('RGB', image.size, BACKGROUND)
+        flat.paste(image, mask=image.getchannel('A'))
+        return flat
+    return image.convert('RGB')
+
+
+def encode(image, image_format):
+    """Image is saved without info, so EXIF and other metadata is lost."""
+    buffer = io.BytesIO()
+    image.save(buffer, **FORMATS[image_format])
+    return buffer.getvalue()
+
+
+def variant_name(recipe_pk, variant, image_format):
+    return f'{VARIANTS_DIR}/{recipe_pk}/{variant}.{image_format}'
+
+
+def delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
+
+
+def variant_files(image_variants):
+    """Names of all files of image_variants field."""
+    return [
+        name
+        for variant in VARIANTS
+        for name in image_variants.get(variant, {}).values()
+    ]
+
+
+def process_recipe_image(recipe):
+    """
+    Normalizes the image of the recipe and generates its variants.
+    The recipe row should be locked by the caller.
+    """
+    storage = recipe.image.storage
+    source_name = recipe.image.name
+    with recipe.image.open('rb') as file:
+        with Image.open(file) as image:
+            image = normalize(image)
+    image.thumbnail(ORIGINAL_MAX_SIZE, Image.LANCZOS)
+
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    original_name = storage.save(
+        f'recipes/{stem}.jpg', ContentFile(encode(image, 'jpeg'))
+    )
+    image_variants = {}
+    for variant, size in VARIANTS.items():
+        resized = ImageOps.fit(image, size, Image.LANCZOS)
+        image_variants[variant] = {}
+        for image_format in FORMATS:
+            name = variant_name(recipe.pk, variant, image_format)
+            storage.delete(name)
+            image_variants[variant][image_format] = storage.save(
+                name, ContentFile(encode(resized, image_format))
+            )
+
+    recipe.image = original_name
+    recipe.image_variants = image_variants
+    # signals do not reset image_variants saved together with the image
+    recipe.save(update_fields=['image', 'image_variants', 'updated_at'])
+    transaction.on_commit(lambda: storage.delete(source_name))
+
+
+def pending_recipes():
+    """
+    Recipes with unprocessed images.
+    Rows are locked with SKIP LOCKED where the database supports it,
+    so several workers do not process the same recipe.
+    """
+    return Recipe.objects.filter(image_variants={}).exclude(
+        image=''
+    ).select_for_update(skip_locked=True).order_by('pk')
+
+
+def process_or_mark_broken(recipe):
+    """
+    Returns the error if the image can not be read. Such recipe keeps
+    the original image and is not taken by pending_recipes again.
+    """
+    try:
+        process_recipe_image(recipe)
+    except (OSError, Image.DecompressionBombError) as error:
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_variants={'error': str(error)}
+        )
+        return str(error)
+    return None
+
+
+@transaction.atomic
+def process_image(recipe_id):
+    """
+    Processes the image of the recipe if it is still pending.
+    Returns False if there is nothing to do, the error if the image
+    is broken and True if it is processed.
+    """
+    recipe = pending_recipes().filter(pk=recipe_id).first()
+    if recipe is None:
+        return False
+    return process_or_mark_broken(recipe) or True
+
+
+def process_pending_images(limit, stdout=None):
+    """Processes up to limit recipes, returns the number of processed."""
+    for processed in range(limit):
+        started = timezone.now()
+        with transaction.atomic():
+            recipe = pending_recipes().first()
+            if recipe is None:
+                return processed
+            error = process_or_mark_broken(recipe)
+        if stdout is not None:
+            result = f'ошибка: {error}' if error else 'готово'
+            stdout.write(
+                f'{recipe.pk}: {result} '
+                f'за {(timezone.now() - started).total_seconds():.2f} с'
+            )
+    return limit
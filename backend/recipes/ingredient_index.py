@@ -0,0 +1,213 @@
+"""
+Process-local index of ingredients used by the API instead of the database.
+
+The index is built on the first query of the process and rebuilt
+when Ingredient rows change. Changes are announced by a version stamp
+in the cache, so all processes using the same cache see them
+(see recipes.signals and import_ingredients command).
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from recipes.models import Ingredient
+
+VERSION_CACHE_KEY = 'ingredient_index_version'
+# number of results returned by fuzzy search
+SEARCH_LIMIT = 20
+# longest part of the name (and the query) compared by fuzzy search
+SEARCH_DEPTH = 32
+# key of the trie node item with positions of all names under the node
+POSITIONS = None
+
+
+def normalize(text):
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def max_distance(query):
+    """Number of typos allowed for the query depends on its length."""
+    if len(query) < 3:
+        return 0
+    if len(query) < 6:
+        return 1
+    return 2
+
+
+def build_trie(keys):
+    """
+    Trie of the names started from each word of the name,
+    so 'джем' finds 'абрикосовый джем'.
+    Each node keeps positions of all names under it.
+    """
+    trie = {}
+    for position, key in enumerate(keys):
+        key = normalize(key)
+        starts = [0] + [i + 1 for i, char in enumerate(key) if char == ' ']
+        for start in starts:
+            node = trie
+            for char in key[start:start + SEARCH_DEPTH]:
+                node = node.setdefault(char, {POSITIONS: []})
+                if node[POSITIONS][-1:] != [position]:
+                    node[POSITIONS].append(position)
+    return trie
+
+
+def fuzzy_prefix_search(trie, query, limit):
+    """
+    Finds names which (or words of which) start with the query
+    with at most limit edit operations (Levenshtein distance).
+    Trie is walked depth-first computing one row of the distance matrix
+    per node; branches where every cell of the row exceeds limit are cut.
+    Only the band of limit cells around the diagonal is computed,
+    cells outside it are greater than limit anyway.
+    Typos in the first letter are rare, so it must match exactly,
+    this cuts most of the trie.
+    Returns dict {position: distance}.
+    """
+    found = {}
+    root = trie.get(query[0])
+    if root is None:
+        return found
+    size, over = len(query), limit + 1
+    # distances between query prefixes and the first letter
+    row = [1] + [min(max(i - 1, 0), over) for i in range(1, size + 1)]
+    stack = [(root, row, 1, over)]
+    while stack:
+        node, previous, depth, parent_distance = stack.pop()
+        distance = previous[size]
+        if distance < parent_distance:
+            # names under the node were not found by its parent
+            # with the same distance
+            for position in node[POSITIONS]:
+                if found.get(position, over) > distance:
+                    found[position] = distance
+        if depth >= size + limit:
+            continue
+        depth += 1
+        low, high = max(1, depth - limit), min(size, depth + limit)
+        for char, child in node.items():
+            if char is POSITIONS:
+                continue
+            current = [over] * (size + 1)
+            if depth <= limit:
+                current[0] = depth
+            left = best = current[low - 1]
+            for i in range(low, high + 1):
+                value = previous[i - 1] + (query[i - 1] != char)
+                if previous[i] + 1 < value:
+                    value = previous[i] + 1
+                if left + 1 < value:
+                    value = left + 1
+                if value > over:
+                    value = over
+                current[i] = left = value
+                if value < best:
+                    best = value
+            if best <= limit:
+                stack.append(
+                    (child, current, depth, min(distance, parent_distance))
+                )
+    return found
+
+
+class Snapshot(NamedTuple):
+    """One build of the index. It is replaced as a whole, so a query
+    reads keys, rows and trie of the same build."""
+    version: object
+    keys: tuple
+    rows: tuple
+    trie: dict
+
+
+class IngredientIndex:
+    """
+    Sorted array of case-folded ingredient names.
+    Prefix query is two binary searches over the array.
+    Fuzzy search walks the trie of the names.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def build(self):
+        """Loads all ingredients, one query. Returns the new snapshot."""
+        version = cache.get(VERSION_CACHE_KEY)
+        ingredients = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit
+            in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = tuple(ingredient[0] for ingredient in ingredients)
+        snapshot = Snapshot(
+            version=version,
+            keys=keys,
+            rows=tuple(
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in ingredients
+            ),
+            trie=build_trie(keys),
+        )
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        """Marks index outdated in all processes sharing the cache."""
+        cache.set(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+
+    def _actual(self):
+        """The current snapshot, rebuilt if it is outdated."""
+        snapshot = self._snapshot
+        if (snapshot is None
+                or cache.get(VERSION_CACHE_KEY) != snapshot.version):
+            snapshot = self.build()
+        return snapshot
+
+    def startswith(self, prefix):
+        """
+        Returns ingredients which names start with prefix, case-insensitive,
+        ordered by name. Items are dicts in IngredientSerializer format.
+        """
+        snapshot = self._actual()
+        keys, rows = snapshot.keys, snapshot.rows
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', start)
+        return list(rows[start:end])
+
+    def search(self, query):
+        """
+        Typo-tolerant search. Returns up to SEARCH_LIMIT ingredients
+        which names (or words of names) start with the query
+        with a few typos. The closest come first, then names
+        starting with the query, then the shorter ones.
+        Items are dicts in IngredientSerializer format.
+        """
+        snapshot = self._actual()
+        keys, rows = snapshot.keys, snapshot.rows
+        query = normalize(query)[:SEARCH_DEPTH]
+        if not query:
+            return list(rows[:SEARCH_LIMIT])
+        found = fuzzy_prefix_search(
+            snapshot.trie, query, max_distance(query)
+        )
+        ranked = sorted(
+            found,
+            key=lambda position: (
+                found[position],
+                not keys[position].startswith(query[0]),
+                len(keys[position]),
+                position,
+            )
+        )
+        return [rows[position] for position in ranked[:SEARCH_LIMIT]]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,87 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.ingredient_index import ingredient_index
+from recipes.models import Ingredient
+
+DEFAULT_PREFIXES = ('а', 'мо', 'сах', 'кур', 'пом', 'сыр', 'я', 'хлеб')
+DEFAULT_TYPOS = ('малако', 'сахор', 'памидор', 'смитана', 'картофиль')
+
+
+# запуск: python manage.py benchmark_ingredient_search --repeat 200
+class Command(BaseCommand):
+    help = ('Сравнение скорости поиска ингредиентов по началу названия: '
+            'запрос к БД (istartswith) и индекс в памяти, '
+            'и скорость поиска с опечатками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'prefixes', nargs='*', default=DEFAULT_PREFIXES,
+            help='Начала названий для поиска.'
+        )
+        parser.add_argument(
+            '--typos', nargs='*', default=DEFAULT_TYPOS,
+            help='Запросы с опечатками для нечёткого поиска.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=100,
+            help='Сколько раз повторить каждый запрос.'
+        )
+
+    def _measure(self, search, prefixes, repeat):
+        """Returns average time of one search in microseconds."""
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for prefix in prefixes:
+                search(prefix)
+        return (time.perf_counter() - start) / repeat / len(prefixes) * 1e6
+
+    def handle(self, *args, **options):
+        prefixes, repeat = options['prefixes'], options['repeat']
+        self.stdout.write(
+            f'Ингредиентов в БД: {Ingredient.objects.count()}'
+        )
+
+        start = time.perf_counter()
+        ingredient_index.build()
+        self.stdout.write(
+            f'Построение индекса: '
+            f'{(time.perf_counter() - start) * 1e3:.1f} мс'
+        )
+
+        for prefix in prefixes:
+            orm = list(Ingredient.objects.filter(
+                name__istartswith=prefix
+            ).values_list('id', flat=True))
+            index = [row['id'] for row in ingredient_index.startswith(prefix)]
+            if sorted(orm) != sorted(index):
+                self.stdout.write(self.style.WARNING(
+                    f'Результаты для "{prefix}" различаются: '
+                    f'БД {len(orm)}, индекс {len(index)}'
+                ))
+
+        orm_time = self._measure(
+            lambda prefix: list(Ingredient.objects.filter(
+                name__istartswith=prefix
+            ).values('id', 'name', 'measurement_unit')),
+            prefixes, repeat
+        )
+        index_time = self._measure(
+            ingredient_index.startswith, prefixes, repeat
+        )
+        self.stdout.write(f'БД (istartswith): {orm_time:.1f} мкс на запрос')
+        self.stdout.write(f'Индекс в памяти: {index_time:.1f} мкс на запрос')
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс быстрее в {orm_time / index_time:.0f} раз.'
+        ))
+
+        for query in options['typos']:
+            search_time = self._measure(
+                ingredient_index.search, [query], repeat
+            )
+            found = [row['name'] for row in ingredient_index.search(query)]
+            self.stdout.write(
+                f'Нечёткий поиск "{query}": {search_time:.1f} мкс, '
+                f'{", ".join(found[:3]) or "ничего не найдено"}'
+            )
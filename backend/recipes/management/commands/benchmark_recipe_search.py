@@ -0,0 +1,143 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.search import search_recipes, update_search_index
+
+User = get_user_model()
+
+DEFAULT_QUERIES = ('молоко', 'сахар', 'курица', 'сыр помидоры', 'шоколад')
+BENCHMARK_USERNAME = 'search_benchmark'
+PAGE_SIZE = 6
+
+
+# запуск: python manage.py benchmark_recipe_search --fill 100000
+class Command(BaseCommand):
+    help = ('Сравнение скорости полнотекстового поиска рецептов '
+            'с поиском через icontains (без индекса).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'queries', nargs='*', default=DEFAULT_QUERIES,
+            help='Поисковые запросы.'
+        )
+        parser.add_argument(
+            '--fill', type=int, default=0,
+            help='Добавить рецепты, чтобы всего их было не меньше N.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Размер пачки при добавлении рецептов.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Сколько раз повторить каждый запрос.'
+        )
+
+    def _fill(self, total, batch_size):
+        """Creates recipes made of random ingredients
+        until there are at least total recipes."""
+        missing = total - Recipe.objects.count()
+        if missing <= 0:
+            return
+        ingredients = list(Ingredient.objects.values_list('id', 'name'))
+        if not ingredients:
+            self.stderr.write('Сначала загрузите ингредиенты.')
+            return
+        author, _ = User.objects.get_or_create(
+            username=BENCHMARK_USERNAME,
+            defaults={
+                'email': f'{BENCHMARK_USERNAME}@example.com',
+                'first_name': 'Search',
+                'last_name': 'Benchmark',
+            }
+        )
+        start = time.perf_counter()
+        while missing > 0:
+            size = min(batch_size, missing)
+            with transaction.atomic():
+                last_id = Recipe.objects.order_by('-id').values_list(
+                    'id', flat=True
+                ).first() or 0
+                recipe_ingredients = []
+                for _ in range(size):
+                    recipe_ingredients.append(
+                        random.sample(ingredients, random.randint(3, 10))
+                    )
+                # bulk_create does not return ids on SQLite,
+                # new recipes are found by id
+                Recipe.objects.bulk_create(
+                    Recipe(
+                        name=' '.join(
+                            name for _, name in chosen[:2]
+                        ).capitalize()[:200],
+                        text=', '.join(name for _, name in chosen)[:600],
+                        author=author,
+                        image='recipes/benchmark.jpg',
+                        cooking_time=random.randint(5, 120),
+                    ) for chosen in recipe_ingredients
+                )
+                recipe_ids = Recipe.objects.filter(
+                    id__gt=last_id
+                ).order_by('id').values_list('id', flat=True)
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=random.randint(1, 500),
+                    )
+                    for recipe_id, chosen in zip(
+                        recipe_ids, recipe_ingredients
+                    )
+                    for ingredient_id, _ in chosen
+                )
+                update_search_index(Recipe.objects.filter(id__gt=last_id))
+            missing -= size
+            self.stdout.write(f'Осталось добавить: {missing}')
+        self.stdout.write(
+            f'Рецепты добавлены за {time.perf_counter() - start:.1f} с'
+        )
+
+    def _measure(self, get_queryset, query, repeat):
+        """Returns average time (ms) to get the first page and the count."""
+        start = time.perf_counter()
+        for _ in range(repeat):
+            queryset = get_queryset(query)
+            list(queryset[:PAGE_SIZE])
+            count = queryset.count()
+        return (time.perf_counter() - start) / repeat * 1e3, count
+
+    def handle(self, *args, **options):
+        self._fill(options['fill'], options['batch_size'])
+        self.stdout.write(f'Рецептов в БД: {Recipe.objects.count()}')
+
+        def full_text(query):
+            return search_recipes(Recipe.objects.all(), query)
+
+        def icontains(query):
+            condition = Q()
+            for word in query.split():
+                condition &= (Q(name__icontains=word)
+                              | Q(text__icontains=word)
+                              | Q(ingredients__name__icontains=word))
+            return Recipe.objects.filter(condition).distinct().order_by(
+                '-created_at'
+            )
+
+        for query in options['queries']:
+            index_time, index_count = self._measure(
+                full_text, query, options['repeat']
+            )
+            scan_time, scan_count = self._measure(
+                icontains, query, options['repeat']
+            )
+            self.stdout.write(
+                f'"{query}": полнотекстовый поиск {index_time:.1f} мс '
+                f'({index_count} найдено), '
+                f'icontains {scan_time:.1f} мс ({scan_count} найдено)'
+            )
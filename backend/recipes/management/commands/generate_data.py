@@ -0,0 +1,377 @@
+import itertools
+import multiprocessing
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes import images
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    TableVersion,
+    Tag,
+)
+from recipes.search import update_search_index
+from users.models import Subscription
+
+User = get_user_model()
+
+PASSWORD = 'generated-password'
+PLACEHOLDER_DIR = 'recipes/generated'
+
+# Data shared with worker processes. It is set before the pool is
+# created, so forked workers inherit it instead of getting it pickled
+# with every chunk.
+shared = {}
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights for random.choices: the item of rank r
+    is chosen with probability proportional to 1 / r ** exponent."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+def heavy_tail(rng, mean, limit):
+    """Pareto distributed count with the given mean: most users have
+    a few rows, some have a lot."""
+    alpha = 1.5  # mean of paretovariate is alpha / (alpha - 1) = 3
+    return min(int(mean * rng.paretovariate(alpha) / 3), limit)
+
+
+def sample_distinct(rng, population, cum_weights, count, exclude=None):
+    """count distinct items chosen with weights, fewer if they
+    can not be found in a few attempts."""
+    chosen = set()
+    for _ in range(5):
+        missing = count - len(chosen)
+        if missing <= 0:
+            break
+        chosen.update(rng.choices(
+            population, cum_weights=cum_weights, k=missing * 2
+        ))
+        chosen.discard(exclude)
+    return list(chosen)[:count]
+
+
+def created_ids(model, objects, last_id):
+    """bulk_create returns ids only on PostgreSQL, on SQLite (one worker)
+    new rows are found by id."""
+    if objects and objects[0].pk is not None:
+        return [obj.pk for obj in objects]
+    return list(model.objects.filter(pk__gt=last_id).order_by(
+        'pk'
+    ).values_list('pk', flat=True))
+
+
+def last_id(model):
+    return model.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 0
+
+
+def make_users(chunk):
+    start, count, seed = chunk
+    rng = random.Random(seed)
+    run = shared['run']
+    now = timezone.now()
+    User.objects.bulk_create((
+        User(
+            username=f'{run}_{number}',
+            email=f'{run}_{number}@example.com',
+            first_name=rng.choice(shared['first_names']),
+            last_name=rng.choice(shared['last_names']),
+            password=shared['password'],
+            date_joined=now - timedelta(minutes=rng.randrange(525600)),
+        ) for number in range(start, start + count)
+    ), batch_size=shared['batch_size'])
+    return count
+
+
+def make_recipes(chunk):
+    """Recipes with ingredients and tags. Authors and ingredients
+    are chosen with Zipf distribution: a few popular authors write
+    most recipes, a few ingredients are used in most of them."""
+    start, count, seed = chunk
+    rng = random.Random(seed)
+    authors = shared['all_users']
+    author_weights = shared['author_weights']
+    ingredients = shared['ingredients']
+    ingredient_weights = shared['ingredient_weights']
+    tags = shared['tags']
+    rows = 0
+    with transaction.atomic():
+        previous_id = last_id(Recipe)
+        chosen = [
+            sample_distinct(
+                rng, ingredients, ingredient_weights, rng.randint(3, 12)
+            ) for _ in range(count)
+        ]
+        recipes = Recipe.objects.bulk_create((
+            Recipe(
+                name=' '.join(
+                    name for _, name in items[:2]
+                ).capitalize()[:200],
+                text=', '.join(name for _, name in items)[:600],
+                author_id=rng.choices(authors, cum_weights=author_weights)[0],
+                image=shared['image'],
+                image_variants=shared['image_variants'],
+                cooking_time=rng.randint(5, 180),
+            ) for items in chosen
+        ), batch_size=shared['batch_size'])
+        recipe_ids = created_ids(Recipe, recipes, previous_id)
+        RecipeIngredient.objects.bulk_create((
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe_id, items in zip(recipe_ids, chosen)
+            for ingredient_id, _ in items
+        ), batch_size=shared['batch_size'])
+        Recipe.tags.through.objects.bulk_create((
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tags, rng.randint(1, min(3, len(tags))))
+        ), batch_size=shared['batch_size'])
+        rows += len(recipe_ids) + sum(len(items) for items in chosen)
+        if shared['search_index']:
+            update_search_index(Recipe.objects.filter(pk__in=recipe_ids))
+    return rows
+
+
+def make_relations(chunk):
+    """Favorites, shopping carts and subscriptions of users.
+    Popular recipes and authors get most of them, the number per user
+    has a heavy tail."""
+    start, count, seed = chunk
+    rng = random.Random(seed)
+    users = shared['users'][start:start + count]
+    recipes = shared['recipes']
+    recipe_weights = shared['recipe_weights']
+    authors = shared['all_users']
+    author_weights = shared['author_weights']
+    rows = 0
+    for model, mean, population, weights, field in (
+        (Favorite, shared['favorites'], recipes, recipe_weights, 'recipe'),
+        (ShoppingCart, shared['carts'], recipes, recipe_weights, 'recipe'),
+        (Subscription, shared['subscriptions'], authors, author_weights,
+         'author'),
+    ):
+        if not mean:
+            continue
+        objects = [
+            model(**{'user_id': user_id, f'{field}_id': target})
+            for user_id in users
+            for target in sample_distinct(
+                rng, population, weights,
+                heavy_tail(rng, mean, len(population) - 1),
+                exclude=user_id if model is Subscription else None,
+            )
+        ]
+        model.objects.bulk_create(
+            objects, batch_size=shared['batch_size'], ignore_conflicts=True
+        )
+        rows += len(objects)
+    return rows
+
+
+def chunks(total, size, seed):
+    for number, start in enumerate(range(0, total, size)):
+        yield start, min(size, total - start), seed + number
+
+
+# запуск: python manage.py generate_data --users 100000 --recipes 300000
+class Command(BaseCommand):
+    help = ('Генерация тестовых данных для нагрузочного тестирования: '
+            'пользователи, рецепты, теги, избранное, списки покупок '
+            'и подписки с реалистичным перекосом (популярные авторы, '
+            'большие списки покупок). Ингредиенты должны быть загружены.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее число избранных рецептов пользователя.'
+        )
+        parser.add_argument(
+            '--carts', type=float, default=5,
+            help='Среднее число рецептов в списке покупок пользователя.'
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=10,
+            help='Среднее число подписок пользователя.'
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель распределения Ципфа для популярности '
+                 'авторов, рецептов и ингредиентов, 0 - без перекоса.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help='Число процессов, на SQLite всегда 1.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Строк в одном INSERT.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Пользователей или рецептов в одной задаче процесса.'
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--skip-search-index', action='store_true',
+            help='Не строить поисковый индекс рецептов.'
+        )
+
+    def run(self, title, func, total, options):
+        """Runs func for chunks of total items in worker processes."""
+        if not total:
+            return
+        started = time.monotonic()
+        rows = 0
+        work = chunks(total, options['chunk_size'], self.seed)
+        self.seed += total
+        if self.workers > 1:
+            # forked workers must not share the connection of the parent
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(self.workers) as pool:
+                for done in pool.imap_unordered(func, work):
+                    rows += done
+                    self.progress(title, rows, started)
+        else:
+            for chunk in work:
+                rows += func(chunk)
+                self.progress(title, rows, started)
+
+    def progress(self, title, rows, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            f'{title}: {rows} строк, {rows / elapsed:.0f} строк/с'
+        )
+
+    def placeholder_image(self):
+        """One image with thumbnails shared by all generated recipes."""
+        name = f'{PLACEHOLDER_DIR}/placeholder.jpg'
+        image = Image.new('RGB', images.ORIGINAL_MAX_SIZE, (230, 200, 160))
+        if not default_storage.exists(name):
+            default_storage.save(
+                name, ContentFile(images.encode(image, 'jpeg'))
+            )
+        variants = {}
+        for variant, size in images.VARIANTS.items():
+            variants[variant] = {}
+            for image_format in images.FORMATS:
+                variant_name = f'{PLACEHOLDER_DIR}/{variant}.{image_format}'
+                if not default_storage.exists(variant_name):
+                    default_storage.save(variant_name, ContentFile(
+                        images.encode(image.resize(size), image_format)
+                    ))
+                variants[variant][image_format] = variant_name
+        return name, variants
+
+    def handle(self, *args, **options):
+        ingredients = list(Ingredient.objects.values_list('id', 'name'))
+        if not ingredients:
+            raise CommandError(
+                'Сначала загрузите ингредиенты: '
+                'python manage.py import_ingredients ./data/ingredients.json'
+            )
+        self.seed = (options['seed'] if options['seed'] is not None
+                     else random.randrange(2 ** 32))
+        self.workers = max(options['workers'], 1)
+        if connection.vendor == 'sqlite':
+            # SQLite has one writer, processes would wait for each other
+            self.workers = 1
+        self.stdout.write(f'seed {self.seed}, процессов {self.workers}')
+        rng = random.Random(self.seed)
+        started = time.monotonic()
+
+        tags = []
+        for number in range(options['tags']):
+            tag, _ = Tag.objects.get_or_create(
+                slug=f'generated-{number}',
+                defaults={
+                    'name': f'generated_{number}',
+                    'color': f'#{number * 2654435761 % 16 ** 6:06x}',
+                },
+            )
+            tags.append(tag.pk)
+        TableVersion.bump('tag')
+        if options['recipes'] and not tags:
+            tags = list(Tag.objects.values_list('pk', flat=True))
+        if options['recipes'] and not tags:
+            raise CommandError('Для рецептов нужен хотя бы один тег.')
+
+        image, image_variants = self.placeholder_image()
+        shared.update(
+            run=f'gen{self.seed}',
+            batch_size=options['batch_size'],
+            password=make_password(PASSWORD),
+            first_names=('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей'),
+            last_names=('Иванова', 'Петров', 'Смирнова', 'Кузнецов'),
+            image=image,
+            image_variants=image_variants,
+            ingredients=ingredients,
+            ingredient_weights=zipf_cum_weights(
+                len(ingredients), options['skew']
+            ),
+            tags=tags,
+            search_index=not options['skip_search_index'],
+            favorites=options['favorites'],
+            carts=options['carts'],
+            subscriptions=options['subscriptions'],
+        )
+
+        self.run('Пользователи', make_users, options['users'], options)
+        new_users = list(User.objects.filter(
+            username__startswith=f'{shared["run"]}_'
+        ).order_by('pk').values_list('pk', flat=True))
+        all_users = list(User.objects.values_list('pk', flat=True))
+        # popular authors are random users, not the first ones
+        rng.shuffle(all_users)
+        shared.update(
+            users=new_users,
+            all_users=all_users,
+            author_weights=zipf_cum_weights(len(all_users), options['skew']),
+        )
+        self.run('Рецепты', make_recipes, options['recipes'], options)
+
+        recipes = list(Recipe.objects.values_list('pk', flat=True))
+        rng.shuffle(recipes)
+        shared.update(
+            recipes=recipes,
+            recipe_weights=zipf_cum_weights(len(recipes), options['skew']),
+        )
+        if recipes and len(all_users) > 1:
+            self.run('Избранное, покупки и подписки', make_relations,
+                     len(new_users), options)
+
+        # bulk_create does not send signals, counters, feeds,
+        # shopping lists and popularity are recalculated
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_feed', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('recompute_popularity', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные сгенерированы за {time.monotonic() - started:.1f} с. '
+            f'Пароль пользователей: {PASSWORD}'
+        ))
@@ -1,30 +1,165 @@
+import csv
 import json
 import os
+import re
+import time
 
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.core.management.base import BaseCommand, CommandError
+from recipes.ingredient_index import ingredient_index
+from recipes.models import Ingredient, TableVersion
+
+CHUNK_SIZE = 64 * 1024
+# an object not parsed after this many characters is malformed
+MAX_OBJECT_SIZE = 1024 * 1024
+# the first character after whitespace, empty at the end of the buffer
+NEXT_CHAR = re.compile(r'[ \t\r\n]*(.?)', re.DOTALL)
+
+
+def read_json(file):
+    """
+    Yields objects of the JSON array one by one.
+    The file is read by chunks, only the current chunk and the current
+    object are kept in memory. A malformed or unterminated object
+    is not buffered beyond MAX_OBJECT_SIZE.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    end_of_file = False
+    while True:
+        # skip whitespace and separators between objects
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('JSON file should contain an array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                pass  # the object is not read completely
+            else:
+                # a number may continue in the next chunk (12|3, 4.5|e1),
+                # the item is complete when a separator follows it
+                following = NEXT_CHAR.match(buffer, end).group(1)
+                if following in (',', ']') or end_of_file:
+                    position = end
+                    yield item
+                    continue
+        if end_of_file:
+            raise ValueError('Unexpected end of JSON file')
+        if len(buffer) - position > MAX_OBJECT_SIZE:
+            raise ValueError(
+                f'JSON object is longer than {MAX_OBJECT_SIZE} characters '
+                f'or malformed: {buffer[position:position + 100]!r}'
+            )
+        chunk = file.read(CHUNK_SIZE)
+        if chunk:
+            buffer = buffer[position:] + chunk
+            position = 0
+        else:
+            end_of_file = True
+
+
+def read_csv(file):
+    """Rows are name and measurement unit, the header is optional."""
+    for row in csv.reader(file):
+        if not row or row == ['name', 'measurement_unit']:
+            continue
+        name, measurement_unit = row
+        yield {'name': name, 'measurement_unit': measurement_unit}
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+}
+
+
+def batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 # запуск: python manage.py import_ingredients ./data/ingredients.json
 class Command(BaseCommand):
-    help = 'Загрузка данных из json файла в модель Ingredients.'
+    help = ('Загрузка ингредиентов из json или csv файла в модель '
+            'Ingredients. Уже существующие ингредиенты пропускаются, '
+            'поэтому команду можно запускать повторно.')
 
     def add_arguments(self, parser):
-        parser.add_argument('json_file', type=str, help='Путь до JSON файла.')
+        parser.add_argument(
+            'file', type=str, help='Путь до JSON или CSV файла.'
+        )
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Формат файла, по умолчанию по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько ингредиентов записывать за один запрос.'
+        )
 
     def handle(self, *args, **options):
-        json_file = options['json_file']
-        absolute_path = os.path.abspath(json_file)
-        self.stdout.write(f'Parsing JSON file: {absolute_path}')
-
-        with open(json_file, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-
-        # Создание списка объектов модели для bulk_create
-        objects_to_create = [
-            Ingredient(name=item['name'],
-                       measurement_unit=item['measurement_unit'])
-            for item in data
-        ]
-        Ingredient.objects.bulk_create(objects_to_create)
-        self.stdout.write(self.style.SUCCESS('Данные загружены в БД.'))
+        path = options['file']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(
+                f'Неизвестный формат файла: {file_format}, '
+                f'укажите --format'
+            )
+        self.stdout.write(f'Parsing {file_format} file: '
+                          f'{os.path.abspath(path)}')
+
+        count_before = Ingredient.objects.count()
+        processed = 0
+        started = time.monotonic()
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            try:
+                for batch in batches(READERS[file_format](file),
+                                     options['batch_size']):
+                    # conflicts with the unique constraint
+                    # (existing ingredients) are skipped by the database
+                    Ingredient.objects.bulk_create(
+                        (Ingredient(
+                            name=item['name'].strip(),
+                            measurement_unit=item['measurement_unit'].strip()
+                        ) for item in batch),
+                        ignore_conflicts=True,
+                    )
+                    processed += len(batch)
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    self.stdout.write(
+                        f'Обработано {processed} строк, '
+                        f'{processed / elapsed:.0f} строк/с'
+                    )
+            # items which are not objects with string name
+            # and measurement_unit fail with the first three
+            except (AttributeError, KeyError, TypeError, ValueError) as error:
+                raise CommandError(
+                    f'Ошибка в файле после {processed} строк: {error!r}'
+                )
+        created = Ingredient.objects.count() - count_before
+        # bulk_create does not send signals, index is invalidated
+        # and table version is changed manually
+        if created:
+            ingredient_index.invalidate()
+            TableVersion.bump('ingredient')
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные загружены в БД: добавлено {created}, '
+            f'пропущено {processed - created} '
+            f'за {time.monotonic() - started:.2f} с.'
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_pending_images
+
+
+# запуск: python manage.py process_images --loop
+class Command(BaseCommand):
+    help = ('Обработка загруженных изображений рецептов: нормализация, '
+            'удаление метаданных, миниатюры в JPEG и WebP.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, проверяя новые изображения.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2,
+            help='Пауза в секундах, если новых изображений нет.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Сколько изображений обработать за один проход.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_images(
+                options['batch_size'], stdout=self.stdout
+            )
+            if not options['loop']:
+                break
+            if processed < options['batch_size']:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Изображения обработаны.'))
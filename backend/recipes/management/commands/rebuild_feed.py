@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import feed
+
+
+# запуск: python manage.py rebuild_feed
+class Command(BaseCommand):
+    help = ('Заполнение лент рецептов подписчиков заново по подпискам, '
+            'нужно после массового импорта подписок или рецептов.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            inserted = feed.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты заполнены, записей: {inserted}.'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import shopping_list
+
+
+# запуск: python manage.py rebuild_shopping_lists
+class Command(BaseCommand):
+    help = ('Заполнение списков покупок заново по корзинам, '
+            'нужно после массового импорта корзин или рецептов.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = shopping_list.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок заполнены, строк: {rows}.'
+        ))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.popularity import recompute_changed
+
+
+# запуск: python manage.py recompute_popularity --loop
+class Command(BaseCommand):
+    help = ('Пересчёт популярности рецептов по избранному и спискам '
+            'покупок с затуханием по времени. Пересчитываются только '
+            'рецепты, изменившиеся с прошлого запуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, пересчитывая через --interval.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=300,
+            help='Пауза в секундах между пересчётами.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько рецептов пересчитать за один запрос.'
+        )
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            recomputed = recompute_changed(full, options['batch_size'])
+            self.stdout.write(f'Пересчитано рецептов: {recomputed}')
+            if not options['loop']:
+                break
+            full = False
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Популярность пересчитана.'))
@@ -0,0 +1,105 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from recipes.models import (
+    Favorite,
+    Recipe,
+    RecipeCounterShard,
+    ShoppingCart,
+)
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def count_rows(model, field):
+    """Number of rows of the model referencing the outer row by field."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def shard_deltas(counter):
+    """Changes of the recipe counter not yet folded from shards."""
+    return Coalesce(Subquery(
+        RecipeCounterShard.objects.filter(
+            recipe=OuterRef('pk'), counter=counter
+        ).values('recipe').annotate(total=Sum('delta')).values('total')
+    ), 0)
+
+
+# (model, counter field, value the field should have)
+COUNTERS = (
+    (
+        Recipe, 'favorites_count',
+        count_rows(Favorite, 'recipe')
+        - shard_deltas(RecipeCounterShard.FAVORITES)
+    ),
+    (
+        Recipe, 'carts_count',
+        count_rows(ShoppingCart, 'recipe')
+        - shard_deltas(RecipeCounterShard.CARTS)
+    ),
+    (User, 'recipes_count', count_rows(Recipe, 'author')),
+    (User, 'followers_count', count_rows(Subscription, 'author')),
+)
+
+
+# запуск: python manage.py reconcile_counters
+class Command(BaseCommand):
+    help = ('Перенос шардов счётчиков в рецепты и исправление '
+            'расхождений счётчиков с данными.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не менять.'
+        )
+
+    @transaction.atomic
+    def fold_shards(self):
+        """Adds deltas of shards to recipe counters and deletes shards.
+        Shard rows are locked, so concurrent changes are not lost."""
+        shards = list(RecipeCounterShard.objects.select_for_update(
+        ).values_list('pk', 'recipe', 'counter', 'delta'))
+        totals = {}
+        for _, recipe, counter, delta in shards:
+            key = (recipe, f'{counter}_count')
+            totals[key] = totals.get(key, 0) + delta
+        # changes of the shards are kept for recipes.popularity
+        for (recipe, field), total in totals.items():
+            Recipe.objects.filter(pk=recipe).update(
+                **{field: F(field) + total},
+                counters_updated_at=timezone.now(),
+            )
+        RecipeCounterShard.objects.filter(
+            pk__in=[shard[0] for shard in shards]
+        ).delete()
+        return len(totals)
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            folded = self.fold_shards()
+            self.stdout.write(f'Перенесено счётчиков из шардов: {folded}')
+        for model, field, actual in COUNTERS:
+            drifted = model.objects.annotate(expected=actual).exclude(
+                **{field: F('expected')}
+            )
+            if options['dry_run']:
+                self.stdout.write(
+                    f'{model.__name__}.{field}: '
+                    f'расхождений {drifted.count()}'
+                )
+                continue
+            with transaction.atomic():
+                fixed = model.objects.filter(
+                    pk__in=list(drifted.values_list('pk', flat=True))
+                ).update(**{field: actual})
+            self.stdout.write(f'{model.__name__}.{field}: исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены.'))
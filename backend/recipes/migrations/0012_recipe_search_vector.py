@@ -0,0 +1,81 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRESQL_INDEX = (
+    'CREATE INDEX recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)'
+)
+POSTGRESQL_FILL = """
+UPDATE recipes_recipe r SET search_vector =
+    setweight(to_tsvector('russian', r.name), 'A')
+    || setweight(to_tsvector('russian', coalesce((
+        SELECT string_agg(i.name, ' ')
+        FROM recipes_recipeingredient ri
+        JOIN recipes_ingredient i ON i.id = ri.ingredient_id
+        WHERE ri.recipe_id = r.id
+    ), '')), 'B')
+    || setweight(to_tsvector('russian', r.text), 'C')
+"""
+SQLITE_TABLE = (
+    'CREATE VIRTUAL TABLE recipes_recipe_fts '
+    'USING fts5(name, ingredients, text)'
+)
+SQLITE_FILL = """
+INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text)
+SELECT r.id, r.name, (
+    SELECT group_concat(i.name, ' ')
+    FROM recipes_recipeingredient ri
+    JOIN recipes_ingredient i ON i.id = ri.ingredient_id
+    WHERE ri.recipe_id = r.id
+), r.text
+FROM recipes_recipe r
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(POSTGRESQL_INDEX)
+        schema_editor.execute(POSTGRESQL_FILL)
+    elif vendor == 'sqlite':
+        schema_editor.execute(SQLITE_TABLE)
+        schema_editor.execute(SQLITE_FILL)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX recipe_search_vector_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_auto_20230925_1313'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Name, ingredients and description for full-text search, see recipes.search', null=True),
+        ),
+        # GIN index exists only on PostgreSQL,
+        # SQLite (DEBUG) uses FTS5 table instead
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='recipe',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
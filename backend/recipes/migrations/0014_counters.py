@@ -0,0 +1,60 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def count_rows(model, field):
+    """Number of rows of the model referencing the outer row by field."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    Recipe.objects.update(
+        favorites_count=count_rows(Favorite, 'recipe'),
+        carts_count=count_rows(ShoppingCart, 'recipe'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_keyset_pagination_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Number of users who added the recipe to shopping cart, see recipes.counters'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Number of users who favored the recipe, see recipes.counters'),
+        ),
+        migrations.CreateModel(
+            name='RecipeCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counter', models.CharField(choices=[('favorites', 'Favorites'), ('carts', 'Shopping carts')], max_length=20)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('delta', models.IntegerField(default=0, help_text='Change of the counter not yet added to the recipe')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='recipes.recipe')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='recipecountershard',
+            constraint=models.UniqueConstraint(fields=('recipe', 'counter', 'shard'), name='unique_recipe_counter_shard'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(help_text='Name of the model, e.g. tag', max_length=100, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Table version',
+                'verbose_name_plural': 'Table versions',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Time of the last change of the recipe, its ingredients, tags or author, see recipes.signals'),
+        ),
+    ]
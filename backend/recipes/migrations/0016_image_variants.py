@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_conditional_get'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False, help_text='Names of thumbnails of the image by size and format, empty until the image is processed, see recipes.images'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Earlier imports could create the same ingredient several times.
+    Recipes are moved to the first copy, if the recipe already has it
+    the amounts are summed.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep=Min('pk'), copies=Count('pk')
+    ).filter(copies__gt=1)
+    for duplicate in duplicates.iterator():
+        copies = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(pk=duplicate['keep'])
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+                ingredient__in=copies):
+            kept, created = RecipeIngredient.objects.get_or_create(
+                recipe_id=recipe_ingredient.recipe_id,
+                ingredient_id=duplicate['keep'],
+                defaults={'amount': recipe_ingredient.amount},
+            )
+            if not created:
+                kept.amount += recipe_ingredient.amount
+                kept.save(update_fields=['amount'])
+            recipe_ingredient.delete()
+        copies.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_measurement_unit'),
+        ),
+    ]
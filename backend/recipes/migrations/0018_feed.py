@@ -0,0 +1,61 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def fill_feeds(apps, schema_editor):
+    """Feeds of existing subscriptions, see recipes.feed."""
+    FeedItem = apps.get_model('recipes', 'FeedItem')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscription = apps.get_model('users', 'Subscription')
+    Subscription.objects.update(feed_synced_at=timezone.now())
+    for user_id, author_id in Subscription.objects.values_list(
+            'user_id', 'author_id').iterator():
+        FeedItem.objects.bulk_create(
+            (
+                FeedItem(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    created_at=created_at,
+                )
+                for recipe_id, created_at in Recipe.objects.filter(
+                    author_id=author_id
+                ).values_list('pk', 'created_at').iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0017_unique_ingredient'),
+        ('users', '0008_subscription_feed_synced_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_items', to='recipes.recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['user', '-created_at', '-recipe'], name='feed_user_created_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_recipe'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='popularity',
+            field=models.FloatField(default=0, editable=False, help_text='Favorites and shopping carts with time decay, see recipes.popularity'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='popularity_events',
+            field=models.IntegerField(default=0, editable=False, help_text='Sum of the counters when popularity was computed'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-popularity', '-id'], name='recipe_popularity_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+def move_popularity_run(apps, schema_editor):
+    """The start of the last popularity run was kept in TableVersion."""
+    TableVersion = apps.get_model('recipes', 'TableVersion')
+    JobRun = apps.get_model('recipes', 'JobRun')
+    row = TableVersion.objects.filter(table='popularity').first()
+    if row is not None:
+        JobRun.objects.create(job='popularity', started_at=row.updated_at)
+        row.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0020_shopping_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(help_text='Name of the job, e.g. popularity', max_length=100, unique=True)),
+                ('started_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Job run',
+                'verbose_name_plural': 'Job runs',
+            },
+        ),
+        migrations.RunPython(move_popularity_run, migrations.RunPython.noop),
+    ]
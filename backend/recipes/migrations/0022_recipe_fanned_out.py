@@ -0,0 +1,31 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled_recipes(apps, schema_editor):
+    """Recipes of authors above the limit were not fanned out."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.filter(
+        author__followers_count__gt=getattr(
+            settings, 'FEED_FANOUT_LIMIT', 5000
+        )
+    ).update(fanned_out=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_job_run'),
+        ('users', '0008_subscription_feed_synced_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=True, editable=False, help_text='Added to the feeds of followers when created, otherwise followers pull it, see recipes.feed'),
+        ),
+        migrations.RunPython(mark_pulled_recipes, migrations.RunPython.noop),
+    ]
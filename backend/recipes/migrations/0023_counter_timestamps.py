@@ -0,0 +1,40 @@
+# Generated by Django 3.2.20 on 2026-10-18 18:12
+
+from django.db import migrations, models
+from django.db.models import F, Q
+import django.utils.timezone
+
+
+def mark_changed_recipes(apps, schema_editor):
+    """Changes not yet seen by recompute_popularity were found by
+    comparing popularity_events with the counters."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.filter(
+        ~Q(popularity_events=F('favorites_count') + F('carts_count'))
+        | Q(counter_shards__isnull=False)
+    ).update(counters_updated_at=django.utils.timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_recipe_fanned_out'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='counters_updated_at',
+            field=models.DateTimeField(db_index=True, editable=False, help_text='Last change of favorites_count or carts_count, removed rows are recomputed by recipes.popularity', null=True),
+        ),
+        migrations.AddField(
+            model_name='recipecountershard',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Last change of the delta, see recipes.popularity'),
+        ),
+        migrations.RunPython(mark_changed_recipes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='popularity_events',
+        ),
+    ]
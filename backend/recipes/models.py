@@ -1,6 +1,22 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Q,
+    Sum,
+    Value,
+    Window,
+)
+from django.db.models.functions import Coalesce, RowNumber
 from django.core.validators import MinValueValidator, RegexValidator
+from django.utils import timezone
+
+from users.models import Subscription
 
 User = get_user_model()
 
@@ -46,13 +62,114 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ingredient'
         verbose_name_plural = 'Ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_measurement_unit'
+            )
+        ]
 
     def __str__(self):
         return f'{self.name} - {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Loads author, tags and ingredients in a fixed number of queries,
+        whatever the number of recipes."""
+        return self.prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """
+        Prefetches authors with is_subscribed annotation for the given user.
+        Anonymous user has no favorites, carts and subscriptions,
+        so all flags are False in this case. is_favorited and
+        is_in_shopping_cart of other users are not annotated, serializers
+        look recipes up in the cached sets of the user, see api.engagement.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            ).prefetch_related(Prefetch(
+                'author',
+                queryset=User.objects.annotate(is_subscribed=Value(
+                    False, output_field=models.BooleanField()
+                ))
+            ))
+        return self.prefetch_related(Prefetch(
+            'author',
+            queryset=User.objects.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        ))
+
+    def touch(self):
+        """Marks recipes changed, e.g. when their ingredients change."""
+        return self.update(updated_at=timezone.now())
+
+    def with_counters(self):
+        """
+        Annotates current values of sharded counters:
+        favorites_total and carts_total, see recipes.counters.
+        """
+        return self.annotate(
+            favorites_total=F('favorites_count') + Coalesce(
+                Sum('counter_shards__delta', filter=Q(
+                    counter_shards__counter=RecipeCounterShard.FAVORITES
+                )), 0
+            ),
+            carts_total=F('carts_count') + Coalesce(
+                Sum('counter_shards__delta', filter=Q(
+                    counter_shards__counter=RecipeCounterShard.CARTS
+                )), 0
+            ),
+        )
+
+    def limited_per_author(self, authors, limit):
+        """
+        Returns dict {author id: list of the newest recipes of the author}
+        with at most `limit` recipes per author.
+        All authors are served by one query ranked with ROW_NUMBER
+        partitioned by author.
+        """
+        recipes = {author.pk: [] for author in authors}
+        if not recipes or limit < 1:
+            return recipes
+        ranked = self.filter(author__in=recipes.keys()).annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('author')],
+                order_by=F('created_at').desc(),
+            )
+        )
+        # Django 3.2 can not filter on window functions,
+        # so the ranked query is wrapped into a subquery
+        sql, params = ranked.query.sql_with_params()
+        for recipe in self.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            f'WHERE row_number <= %s ORDER BY author_id, row_number',
+            (*params, limit)
+        ):
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+
 class Recipe(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='Time of the last change of the recipe, its ingredients, '
+                  'tags or author, see recipes.signals'
+    )
     name = models.CharField(
         max_length=200,
         help_text='Name of the recipe'
@@ -68,6 +185,12 @@ class Recipe(models.Model):
     image = models.ImageField(
         upload_to='recipes/'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        help_text='Names of thumbnails of the image by size and format, '
+                  'empty until the image is processed, see recipes.images'
+    )
     ingredients = models.ManyToManyField(
         Ingredient,
         through='RecipeIngredient',
@@ -87,9 +210,65 @@ class Recipe(models.Model):
         help_text='Time to cook according to the recipe'
     )
 
+    favorites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text='Number of users who favored the recipe, '
+                  'see recipes.counters'
+    )
+    carts_count = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text='Number of users who added the recipe to shopping cart, '
+                  'see recipes.counters'
+    )
+    popularity = models.FloatField(
+        default=0,
+        editable=False,
+        help_text='Favorites and shopping carts with time decay, '
+                  'see recipes.popularity'
+    )
+    counters_updated_at = models.DateTimeField(
+        null=True,
+        editable=False,
+        db_index=True,
+        help_text='Last change of favorites_count or carts_count, '
+                  'removed rows are recomputed by recipes.popularity'
+    )
+    fanned_out = models.BooleanField(
+        default=True,
+        editable=False,
+        help_text='Added to the feeds of followers when created, '
+                  'otherwise followers pull it, see recipes.feed'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text='Name, ingredients and description for full-text search, '
+                  'see recipes.search'
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Recipe',
         verbose_name_plural = 'Recipes'
+        indexes = [
+            # keyset pagination, see api.paginators.KeysetPagination
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_id_idx'
+            ),
+            models.Index(
+                fields=['-popularity', '-id'],
+                name='recipe_popularity_id_idx'
+            ),
+            # created only on PostgreSQL, see migration 0012
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -137,6 +316,7 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Favorite recipes of a user'
     )
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
         constraints = [
@@ -161,6 +341,7 @@ class ShoppingCart(models.Model):
         related_name='carts',
         verbose_name='Favorite recipes of a user'
     )
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
         constraints = [
@@ -169,3 +350,182 @@ class ShoppingCart(models.Model):
                 name='unique_shoppingcart'
             )
         ]
+
+
+class ShoppingListItem(models.Model):
+    """
+    Ingredient of the shopping list of the user with the amount summed
+    over all recipes in the shopping cart. Changed in the same transaction
+    as the cart and ingredients of the recipes, see recipes.shopping_list.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    amount = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_ingredient'
+            )
+        ]
+
+
+class FeedItem(models.Model):
+    """
+    Recipe in the feed of a follower of its author, see recipes.feed.
+    author and created_at are copied from the recipe, so the feed
+    is read by one range scan of the index and the recipes of an author
+    are removed from the feed without joins.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_recipe'
+            )
+        ]
+        indexes = [
+            # keyset pagination of the feed
+            models.Index(
+                fields=['user', '-created_at', '-recipe'],
+                name='feed_user_created_at_idx'
+            ),
+        ]
+
+
+class RecipeCounterShard(models.Model):
+    """
+    Part of the counter of a popular recipe.
+    Changes of sharded counters are spread over several rows
+    instead of one recipe row, so concurrent writers do not wait
+    for each other. Shards are folded into the recipe
+    by reconcile_counters command.
+    """
+    FAVORITES = 'favorites'
+    CARTS = 'carts'
+    COUNTERS = (
+        (FAVORITES, 'Favorites'),
+        (CARTS, 'Shopping carts'),
+    )
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='counter_shards',
+    )
+    counter = models.CharField(
+        max_length=20,
+        choices=COUNTERS,
+    )
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(
+        default=0,
+        help_text='Change of the counter not yet added to the recipe'
+    )
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        help_text='Last change of the delta, see recipes.popularity'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'counter', 'shard'],
+                name='unique_recipe_counter_shard'
+            )
+        ]
+
+
+class TableVersion(models.Model):
+    """
+    Version of a table, changed on every write to the table.
+    Used for ETag of responses with the whole table.
+    """
+    table = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text='Name of the model, e.g. tag'
+    )
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Table version'
+        verbose_name_plural = 'Table versions'
+
+    def __str__(self):
+        return f'{self.table} v{self.version}'
+
+    @classmethod
+    def bump(cls, table):
+        updated = cls.objects.filter(table=table).update(
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            cls.objects.get_or_create(table=table, defaults={'version': 1})
+
+    @classmethod
+    def get(cls, table):
+        """Returns (version, updated_at)."""
+        version = cls.objects.filter(table=table).values_list(
+            'version', 'updated_at'
+        ).first()
+        return version or (0, None)
+
+
+class JobRun(models.Model):
+    """Start of the last run of a periodic job, the next run
+    processes changes made since then."""
+    job = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text='Name of the job, e.g. popularity'
+    )
+    started_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Job run'
+        verbose_name_plural = 'Job runs'
+
+    def __str__(self):
+        return f'{self.job} {self.started_at}'
+
+    @classmethod
+    def last_started_at(cls, job):
+        return cls.objects.filter(job=job).values_list(
+            'started_at', flat=True
+        ).first()
+
+    @classmethod
+    def started(cls, job, started_at):
+        cls.objects.update_or_create(
+            job=job, defaults={'started_at': started_at}
+        )
@@ -0,0 +1,111 @@
+"""
+Popularity of recipes: favorites and shopping carts with time decay.
+
+A favorite or a shopping cart added at time t adds
+weight * 2 ** ((t - EPOCH) / half-life) to the popularity of the recipe,
+so activity loses half of its weight relative to new activity every
+POPULARITY_HALF_LIFE_DAYS. The stored score is log2 of the sum. It does
+not depend on the time it is computed at, so scores computed by different
+runs are comparable and a recipe is recomputed only when its activity
+changes.
+
+recompute_popularity command recomputes recipes with favorites or carts
+added since the previous run and recipes whose counters changed since
+then (Recipe.counters_updated_at or RecipeCounterShard.updated_at):
+removed rows leave no other trace. Each source is read by an index,
+so a run does not scan all recipes. Cached recipe lists are outdated
+after recomputing, as they may be ordered by popularity.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.cache import invalidate_recipes
+from recipes.models import (
+    Favorite,
+    JobRun,
+    Recipe,
+    RecipeCounterShard,
+    ShoppingCart,
+)
+
+EPOCH = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+# (model, weight): a recipe in a shopping cart is going to be cooked
+WEIGHTS = ((Favorite, 1), (ShoppingCart, 2))
+# JobRun row with the start of the previous run
+JOB = 'popularity'
+# rows are committed some time after created_at is set,
+# each run looks this far back from the previous run
+OVERLAP = timedelta(minutes=5)
+
+
+def half_life():
+    return timedelta(days=getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 7))
+
+
+def score(events):
+    """log2 of the sum of decayed weights of [(weight, created_at)],
+    0 without events."""
+    if not events:
+        return 0
+    exponents = [
+        math.log2(weight) + (created_at - EPOCH) / half_life()
+        for weight, created_at in events
+    ]
+    top = max(exponents)
+    return top + math.log2(sum(2 ** (value - top) for value in exponents))
+
+
+def changed_recipes(since):
+    """Ids of recipes whose score may have changed since the time,
+    all recipes if since is None."""
+    if since is None:
+        return set(Recipe.objects.values_list('pk', flat=True))
+    since -= OVERLAP
+    recipe_ids = set(Recipe.objects.filter(
+        counters_updated_at__gte=since
+    ).values_list('pk', flat=True))
+    recipe_ids.update(RecipeCounterShard.objects.filter(
+        updated_at__gte=since
+    ).values_list('recipe_id', flat=True).distinct())
+    for model, _ in WEIGHTS:
+        recipe_ids.update(model.objects.filter(
+            created_at__gte=since
+        ).values_list('recipe_id', flat=True).distinct())
+    return recipe_ids
+
+
+def recompute(recipe_ids, batch_size=500):
+    """Returns the number of recomputed recipes."""
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), batch_size):
+        recipes = Recipe.objects.only('popularity').in_bulk(
+            recipe_ids[start:start + batch_size]
+        )
+        events = {pk: [] for pk in recipes}
+        for model, weight in WEIGHTS:
+            for recipe_id, created_at in model.objects.filter(
+                    recipe__in=recipes.keys()
+            ).values_list('recipe_id', 'created_at').iterator():
+                events[recipe_id].append((weight, created_at))
+        for pk, recipe in recipes.items():
+            recipe.popularity = score(events[pk])
+        Recipe.objects.bulk_update(recipes.values(), ['popularity'])
+    return len(recipe_ids)
+
+
+def recompute_changed(full=False, batch_size=500):
+    """Recomputes recipes changed since the previous run,
+    all recipes if full. Returns the number of recomputed recipes."""
+    started = timezone.now()
+    since = JobRun.last_started_at(JOB)
+    recomputed = recompute(
+        changed_recipes(None if full else since), batch_size
+    )
+    if recomputed:
+        # scores are written by bulk_update without signals
+        invalidate_recipes([])
+    JobRun.started(JOB, started)
+    return recomputed
@@ -0,0 +1,128 @@
+"""
+Full-text search over name, description and ingredient names of recipes.
+
+PostgreSQL: Recipe.search_vector (tsvector) with GIN index,
+ranked by ts_rank.
+SQLite (DEBUG): FTS5 table recipes_recipe_fts with rowid = recipe id,
+ranked by bm25.
+
+The document of the recipe is updated after the transaction which changed
+the recipe or its ingredients is committed, see recipes.signals.
+"""
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections
+from django.db.models import (
+    F,
+    OuterRef,
+    Subquery,
+    TextField,
+    Value,
+)
+from django.db.models.functions import Coalesce
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# bm25 weights of FTS_TABLE columns: name, ingredients, text
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+
+def _vendor(queryset):
+    return connections[queryset.db].vendor
+
+
+def _fts_query(query):
+    """Every word of the query must be found, as a word prefix.
+    Words are quoted, so FTS5 operators in the query are not interpreted."""
+    words = query.replace('"', ' ').split()
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def update_search_index(recipes):
+    """Rebuilds search documents of the recipes (Recipe queryset)."""
+    if _vendor(recipes) == 'postgresql':
+        from recipes.models import RecipeIngredient
+
+        ingredient_names = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+        recipes.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    Subquery(ingredient_names),
+                    Value(''),
+                    output_field=TextField()
+                ),
+                weight='B',
+                config=SEARCH_CONFIG
+            )
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+    elif _vendor(recipes) == 'sqlite':
+        ids = list(recipes.values_list('pk', flat=True))
+        if not ids:
+            return
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connections[recipes.db].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                ids
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+                f'SELECT r.id, r.name, '
+                f'(SELECT group_concat(i.name, \' \') '
+                f'FROM recipes_recipeingredient ri '
+                f'JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+                f'WHERE ri.recipe_id = r.id), r.text '
+                f'FROM recipes_recipe r WHERE r.id IN ({placeholders})',
+                ids
+            )
+
+
+def remove_from_search_index(recipe_ids, using='default'):
+    """FTS5 table has no foreign key, rows of deleted recipes
+    are removed explicitly. tsvector is deleted with the recipe row."""
+    if connections[using].vendor == 'sqlite' and recipe_ids:
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                list(recipe_ids)
+            )
+
+
+def search_recipes(queryset, query):
+    """
+    Filters recipes by the query and annotates search_rank,
+    the most relevant first.
+    """
+    if _vendor(queryset) == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-created_at')
+    if _vendor(queryset) == 'sqlite':
+        fts_query = _fts_query(query)
+        if not fts_query:
+            return queryset
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        # FTS table is joined to get bm25 of each row in the same scan,
+        # bm25 is negative, the lower the better
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE}.rowid = recipes_recipe.id',
+                f'{FTS_TABLE} MATCH %s',
+            ],
+            params=[fts_query],
+            select={'search_rank': f'-bm25({FTS_TABLE}, {weights})'},
+        ).order_by('-search_rank', '-created_at')
+    return queryset.filter(name__icontains=query)
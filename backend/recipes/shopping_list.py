@@ -0,0 +1,97 @@
+"""
+Shopping lists: ingredients of all recipes in the shopping cart of a user
+with summed amounts, kept in ShoppingListItem table, so downloading
+the list reads only its rows.
+
+Lists are changed by deltas in the same transaction as the change:
+recipes added to or removed from the cart (recipes.signals,
+api.relations) and ingredients of recipes in carts (recipes.signals,
+RecipeCreateSerializer). A delta is one INSERT ... SELECT which adds
+it to the existing row on conflict, rows with nothing left are deleted.
+"""
+from django.db import connection
+from django.db.models import F, IntegerField, Sum, Value
+
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def upsert(queryset, columns):
+    """
+    INSERT INTO shopping list (columns) SELECT ... of the queryset,
+    amounts are added to the rows already in the list.
+    Columns of values() queryset are its fields followed by annotations.
+    """
+    ops = connection.ops
+    table = ops.quote_name(ShoppingListItem._meta.db_table)
+    amount = ops.quote_name('amount')
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} '
+            f'({", ".join(ops.quote_name(column) for column in columns)}) '
+            f'{sql} ON CONFLICT ({ops.quote_name("user_id")}, '
+            f'{ops.quote_name("ingredient_id")}) '
+            f'DO UPDATE SET {amount} = {table}.{amount} + excluded.{amount}',
+            params
+        )
+
+
+def remove_empty(**filters):
+    ShoppingListItem.objects.filter(amount__lte=0, **filters).delete()
+
+
+def change_cart(user_id, recipe_ids, sign):
+    """Ingredients of recipes added to (sign 1)
+    or removed from (sign -1) the cart."""
+    upsert(
+        RecipeIngredient.objects.filter(recipe__in=recipe_ids).values(
+            'ingredient'
+        ).annotate(
+            total=Sum('amount') * sign,
+            user=Value(user_id, output_field=IntegerField()),
+        ),
+        ('ingredient_id', 'amount', 'user_id')
+    )
+    if sign < 0:
+        remove_empty(user=user_id)
+
+
+def add_recipes(user_id, recipe_ids):
+    change_cart(user_id, recipe_ids, 1)
+
+
+def remove_recipes(user_id, recipe_ids):
+    change_cart(user_id, recipe_ids, -1)
+
+
+def change_recipe(recipe_id, deltas):
+    """Ingredients of the recipe changed, deltas are
+    {ingredient id: change of the amount}.
+    Lists of all users with the recipe in the cart are changed."""
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    for ingredient_id, delta in deltas.items():
+        upsert(
+            ShoppingCart.objects.filter(recipe=recipe_id).annotate(
+                ingredient=Value(ingredient_id, output_field=IntegerField()),
+                delta=Value(delta, output_field=IntegerField()),
+            ).values('user_id', 'ingredient', 'delta'),
+            ('user_id', 'ingredient_id', 'amount')
+        )
+    if any(delta < 0 for delta in deltas.values()):
+        remove_empty(user__carts__recipe=recipe_id, ingredient__in=deltas)
+
+
+def rebuild():
+    """Fills shopping lists of all users from carts, used after
+    bulk imports which do not send signals."""
+    ShoppingListItem.objects.all().delete()
+    upsert(
+        RecipeIngredient.objects.filter(recipe__carts__isnull=False).values(
+            'ingredient', user=F('recipe__carts__user')
+        ).annotate(total=Sum('amount')),
+        ('ingredient_id', 'user_id', 'amount')
+    )
+    return ShoppingListItem.objects.count()
@@ -0,0 +1,234 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from recipes import feed, shopping_list
+from recipes.counters import change_recipe_counter, change_user_counter
+from recipes.images import delete_files, variant_files
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeCounterShard,
+    RecipeIngredient,
+    ShoppingCart,
+    TableVersion,
+    Tag,
+)
+from recipes.search import remove_from_search_index, update_search_index
+from recipes.tasks import process_recipe_image
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    """Rebuilds the index after changes are visible to other processes."""
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search(instance, **kwargs):
+    """Name of the ingredient is a part of search documents of recipes."""
+    transaction.on_commit(lambda: update_search_index(
+        Recipe.objects.filter(ingredients=instance)
+    ))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(instance, **kwargs):
+    """
+    Ingredients of the recipe are saved after the recipe
+    (by serializers and admin inlines) in the same transaction,
+    so the document is built when the transaction is committed.
+    """
+    transaction.on_commit(lambda: update_search_index(
+        Recipe.objects.filter(pk=instance.pk)
+    ))
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def update_recipe_ingredients_search(instance, **kwargs):
+    transaction.on_commit(lambda: update_search_index(
+        Recipe.objects.filter(pk=instance.recipe_id)
+    ))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_search(instance, **kwargs):
+    transaction.on_commit(lambda: remove_from_search_index([instance.pk]))
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(instance, created, **kwargs):
+    if created:
+        change_user_counter(instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, **kwargs):
+    if created:
+        feed.fan_out(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(instance, **kwargs):
+    change_user_counter(instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Favorite)
+def increase_favorites_count(instance, created, **kwargs):
+    if created:
+        change_recipe_counter(
+            instance.recipe_id, RecipeCounterShard.FAVORITES, 1
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+def decrease_favorites_count(instance, **kwargs):
+    change_recipe_counter(instance.recipe_id, RecipeCounterShard.FAVORITES, -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def increase_carts_count(instance, created, **kwargs):
+    if created:
+        change_recipe_counter(instance.recipe_id, RecipeCounterShard.CARTS, 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def decrease_carts_count(instance, **kwargs):
+    change_recipe_counter(instance.recipe_id, RecipeCounterShard.CARTS, -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        shopping_list.add_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    shopping_list.remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(instance, **kwargs):
+    """The amount before the change is subtracted from shopping lists."""
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def change_shopping_lists(instance, **kwargs):
+    deltas = {instance.ingredient_id: instance.amount}
+    if instance._previous is not None:
+        ingredient_id, amount = instance._previous
+        deltas[ingredient_id] = deltas.get(ingredient_id, 0) - amount
+    shopping_list.change_recipe(instance.recipe_id, deltas)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_from_shopping_lists(instance, **kwargs):
+    shopping_list.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount}
+    )
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def bump_tag_version(**kwargs):
+    TableVersion.bump('tag')
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_ingredient_version(**kwargs):
+    TableVersion.bump('ingredient')
+
+
+@receiver(post_save, sender=Tag)
+def touch_tag_recipes(instance, **kwargs):
+    Recipe.objects.filter(tags=instance).touch()
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(instance, **kwargs):
+    Recipe.objects.filter(ingredients=instance).touch()
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def touch_recipe_ingredients(instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).touch()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).touch()
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).touch()
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, created, update_fields, **kwargs):
+    """Logins update last_login only, they do not change recipes."""
+    if created or (update_fields
+                   and not set(User.PUBLIC_FIELDS) & set(update_fields)):
+        return
+    Recipe.objects.filter(author=instance).touch()
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+def bump_user_state_version(instance, **kwargs):
+    """is_favorited and is_in_shopping_cart of recipes
+    are changed for the user."""
+    User.objects.filter(pk=instance.user_id).update(
+        state_version=F('state_version') + 1
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+def reset_image_variants(instance, update_fields, **kwargs):
+    """
+    New image is processed by a background task,
+    until then serializers show the original.
+    """
+    if instance._state.adding or (
+            update_fields and 'image_variants' in update_fields):
+        return
+    old = Recipe.objects.filter(pk=instance.pk).values(
+        'image', 'image_variants'
+    ).first()
+    if old is None or old['image'] == instance.image.name:
+        return
+    instance.image_variants = {}
+    storage = instance.image.storage
+    names = variant_files(old['image_variants'])
+    transaction.on_commit(lambda: delete_files(storage, names))
+
+
+@receiver(post_save, sender=Recipe)
+def enqueue_image_processing(instance, **kwargs):
+    """Task does nothing if the image is already processed,
+    so repeated saves of a pending recipe are harmless."""
+    if instance.image and not instance.image_variants:
+        process_recipe_image.enqueue(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_variants(instance, **kwargs):
+    storage = instance.image.storage
+    names = variant_files(instance.image_variants)
+    transaction.on_commit(lambda: delete_files(storage, names))
@@ -0,0 +1,7 @@
+from recipes import images
+from tasks.queue import task
+
+
+@task(max_attempts=3)
+def process_recipe_image(recipe_id):
+    return images.process_image(recipe_id)
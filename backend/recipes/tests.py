@@ -0,0 +1,261 @@
+import io
+import json
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from recipes import ingredient_index, popularity
+from recipes.ingredient_index import IngredientIndex
+from recipes.management.commands import import_ingredients
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+)
+from recipes.search import search_recipes
+
+User = get_user_model()
+
+
+class IngredientIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, unit in (('молоко', 'мл'), ('мука', 'г'),
+                           ('абрикосовый джем', 'г'), ('Мёд', 'г')):
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+
+    def setUp(self):
+        cache.clear()
+        self.index = IngredientIndex()
+
+    def names(self, rows):
+        return [row['name'] for row in rows]
+
+    def test_startswith(self):
+        self.assertEqual(self.names(self.index.startswith('М')),
+                         ['молоко', 'мука', 'Мёд'])
+        self.assertEqual(self.index.startswith('хлеб'), [])
+
+    def test_search_with_typos_and_words(self):
+        self.assertEqual(self.names(self.index.search('малако')),
+                         ['молоко'])
+        self.assertEqual(self.names(self.index.search('джем')),
+                         ['абрикосовый джем'])
+        self.assertEqual(self.names(self.index.search('мед')), ['Мёд'])
+
+    def test_rebuilt_after_invalidate(self):
+        self.assertEqual(self.index.startswith('соль'), [])
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        self.index.invalidate()
+        self.assertEqual(self.names(self.index.startswith('соль')),
+                         ['соль'])
+
+    def test_query_reads_one_snapshot(self):
+        """A rebuild during a query does not mix the trie of one build
+        with the rows of another."""
+        self.index.build()
+        real_normalize = ingredient_index.normalize
+        rebuilt = []
+
+        def normalize(text):
+            if not rebuilt:
+                # a new name shifts positions of all names in the rebuild
+                rebuilt.append(Ingredient.objects.create(
+                    name='ананас', measurement_unit='г'
+                ))
+                self.index.build()
+            return real_normalize(text)
+
+        with mock.patch.object(ingredient_index, 'normalize', normalize):
+            found = self.index.search('малако')
+        self.assertEqual(self.names(found), ['молоко'])
+
+
+class ReadJsonTests(SimpleTestCase):
+
+    def read(self, text, chunk_size):
+        with mock.patch.object(import_ingredients, 'CHUNK_SIZE', chunk_size):
+            return list(import_ingredients.read_json(io.StringIO(text)))
+
+    def test_values_split_between_chunks(self):
+        text = '[12, 3, true, null, "abc", {"a": [1, 2]}, 4.5e1]'
+        for chunk_size in range(1, len(text) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.read(text, chunk_size),
+                                 json.loads(text))
+
+    def test_ingredients_file(self):
+        path = settings.BASE_DIR.parent / 'data' / 'ingredients.json'
+        with open(path, encoding='utf-8') as file:
+            expected = json.load(file)
+        with open(path, encoding='utf-8') as file:
+            with mock.patch.object(import_ingredients, 'CHUNK_SIZE', 7):
+                self.assertEqual(
+                    list(import_ingredients.read_json(file)), expected
+                )
+
+    def test_malformed(self):
+        for text in ('', '{}', '[1, 2', '[{"name": "a"', '[{"a": }]'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.read(text, 4)
+
+    def test_object_size_is_limited(self):
+        text = '[{"name": "' + 'a' * 100
+        with mock.patch.object(import_ingredients, 'MAX_OBJECT_SIZE', 10):
+            with self.assertRaises(ValueError):
+                self.read(text, 4)
+
+
+class ImportIngredientsTests(TestCase):
+
+    def import_text(self, text, suffix='.json'):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            call_command('import_ingredients', file.name, stdout=io.StringIO())
+
+    def test_import_is_idempotent(self):
+        text = json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'сахар', 'measurement_unit': 'г'},
+        ])
+        self.import_text(text)
+        self.import_text(text)
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_not_objects(self):
+        for text in ('["abc"]', '[null]', '[1]', '[{"name": 1}]',
+                     '[{"name": "соль"}]'):
+            with self.subTest(text=text):
+                with self.assertRaises(CommandError):
+                    self.import_text(text)
+
+
+class PopularityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password',
+            first_name='User', last_name='User',
+        )
+        cls.recipe, cls.other = [Recipe.objects.create(
+            name=name, text='Текст', author=cls.user,
+            image='recipes/test.jpg', cooking_time=10,
+        ) for name in ('Рецепт', 'Другой рецепт')]
+
+    def setUp(self):
+        cache.clear()
+
+    def since_now(self):
+        """since of a run that sees only changes made after this call."""
+        return timezone.now() + popularity.OVERLAP
+
+    def test_added_rows(self):
+        since = self.since_now()
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        self.assertEqual(popularity.changed_recipes(since), {self.recipe.pk})
+
+    def test_removed_rows(self):
+        favorite = Favorite.objects.create(user=self.user, recipe=self.recipe)
+        cart = ShoppingCart.objects.create(user=self.user, recipe=self.other)
+        popularity.recompute_changed(full=True)
+        self.recipe.refresh_from_db()
+        self.assertGreater(self.recipe.popularity, 0)
+        since = self.since_now()
+        self.assertEqual(popularity.changed_recipes(since), set())
+        favorite.delete()
+        self.assertEqual(popularity.changed_recipes(since), {self.recipe.pk})
+        popularity.recompute(popularity.changed_recipes(since))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.popularity, 0)
+        self.other.refresh_from_db()
+        counters_updated_at = self.other.counters_updated_at
+        with override_settings(RECIPE_COUNTER_SHARDS=4):
+            cart.delete()
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.counters_updated_at, counters_updated_at)
+        self.assertEqual(popularity.changed_recipes(since),
+                         {self.recipe.pk, self.other.pk})
+
+    def test_folded_shards(self):
+        with override_settings(RECIPE_COUNTER_SHARDS=4):
+            Favorite.objects.create(user=self.user, recipe=self.recipe)
+        since = self.since_now()
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertEqual(popularity.changed_recipes(since), {self.recipe.pk})
+
+    def test_changes_are_found_without_scanning_recipes(self):
+        since = self.since_now()
+        # counter timestamps, shards, favorites and shopping carts
+        with self.assertNumQueries(4):
+            popularity.changed_recipes(since)
+
+
+class RecipeSearchTests(TestCase):
+    """Search documents are updated after commit,
+    so recipes are changed under captureOnCommitCallbacks."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password',
+            first_name='User', last_name='User',
+        )
+        self.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes = self.create_recipe(
+                'Блины', 'Жарить на сковороде', [self.milk]
+            )
+            self.porridge = self.create_recipe(
+                'Овсяная каша', 'Подавать с блинами', []
+            )
+
+    def create_recipe(self, name, text, ingredients):
+        recipe = Recipe.objects.create(
+            name=name, text=text, author=self.user,
+            image='recipes/test.jpg', cooking_time=10,
+        )
+        for ingredient in ingredients:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100
+            )
+        return recipe
+
+    def search(self, query):
+        return list(search_recipes(Recipe.objects.all(), query))
+
+    def test_name_is_ranked_above_text(self):
+        self.assertEqual(self.search('блин'),
+                         [self.pancakes, self.porridge])
+
+    def test_ingredients_and_all_words(self):
+        self.assertEqual(self.search('молоко'), [self.pancakes])
+        self.assertEqual(self.search('блины молоко'), [self.pancakes])
+        self.assertEqual(self.search('каша молоко'), [])
+
+    def test_operators_are_words(self):
+        self.assertEqual(self.search('каша OR "блины'), [])
+        self.assertEqual(self.search('каша NEAR('), [])
+
+    def test_documents_are_updated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milk.name = 'сливки'
+            self.milk.save()
+            self.porridge.delete()
+        self.assertEqual(self.search('сливки'), [self.pancakes])
+        self.assertEqual(self.search('молоко'), [])
+        self.assertEqual(self.search('каша'), [])
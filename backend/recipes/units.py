@@ -0,0 +1,74 @@
+"""
+Measurement units of ingredients.
+
+Ingredient.measurement_unit is free text, the same product comes
+in grams and kilograms, millilitres and spoons. UNITS maps units
+to the canonical unit of their kind and the factor converting
+amounts to it, unknown units are canonical themselves.
+Conversion is done by the database: canonical_unit and factor are
+CASE expressions, so totals in canonical units are summed by one
+GROUP BY query.
+"""
+from django.db.models import Case, CharField, F, FloatField, Value, When
+
+GRAM = 'г'
+MILLILITRE = 'мл'
+PIECE = 'шт.'
+# amounts of these are not summed
+TO_TASTE = ('по вкусу',)
+
+# unit: (canonical unit, factor)
+UNITS = {
+    'г': (GRAM, 1),
+    'гр': (GRAM, 1),
+    'кг': (GRAM, 1000),
+    'мг': (GRAM, 0.001),
+    'мл': (MILLILITRE, 1),
+    'л': (MILLILITRE, 1000),
+    'стакан': (MILLILITRE, 250),
+    'ст. л.': (MILLILITRE, 15),
+    'ч. л.': (MILLILITRE, 5),
+    'капля': (MILLILITRE, 0.05),
+    'шт.': (PIECE, 1),
+    'шт': (PIECE, 1),
+}
+
+
+def _by_value(pairs):
+    """{value: [units]}, one WHEN for each value."""
+    grouped = {}
+    for unit, value in pairs:
+        grouped.setdefault(value, []).append(unit)
+    return grouped.items()
+
+
+def canonical_unit(unit_field):
+    """Expression: canonical unit of the unit in unit_field."""
+    return Case(
+        *(
+            When(**{f'{unit_field}__in': units}, then=Value(canonical))
+            for canonical, units in _by_value(
+                (unit, canonical) for unit, (canonical, _) in UNITS.items()
+            )
+        ),
+        default=F(unit_field),
+        output_field=CharField(),
+    )
+
+
+def factor(unit_field):
+    """Expression: factor converting amounts in unit_field
+    to the canonical unit, NULL for units without amounts."""
+    return Case(
+        When(**{f'{unit_field}__in': TO_TASTE}, then=Value(None)),
+        *(
+            When(**{f'{unit_field}__in': units}, then=Value(float(value)))
+            for value, units in _by_value(
+                (unit, unit_factor)
+                for unit, (_, unit_factor) in UNITS.items()
+            )
+            if value != 1
+        ),
+        default=Value(1.0),
+        output_field=FloatField(),
+    )
@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'name', 'status', 'attempts', 'user',
+        'created_at', 'finished_at'
+    )
+    list_filter = ('status', 'name')
+    readonly_fields = ('started_at', 'finished_at', 'result', 'error')
+    empty_value_display = '-empty-'
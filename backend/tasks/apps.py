@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class TasksConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'tasks'
+    verbose_name = 'Background tasks'
+
+    def ready(self):
+        # task functions are registered in tasks.py modules of apps
+        autodiscover_modules('tasks')
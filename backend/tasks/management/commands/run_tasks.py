@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tasks import queue
+
+
+# запуск: python manage.py run_tasks --loop
+class Command(BaseCommand):
+    help = 'Выполнение фоновых задач из очереди в базе данных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, ожидая новые задачи.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1,
+            help='Пауза в секундах, если задач нет.'
+        )
+        parser.add_argument(
+            '--keep-days', type=int, default=7,
+            help='Через сколько дней удалять выполненные задачи.'
+        )
+
+    def handle(self, *args, **options):
+        purged = queue.purge(options['keep_days'])
+        self.stdout.write(f'Удалено старых задач: {purged}')
+        while True:
+            task = queue.run_next()
+            if task is not None:
+                self.stdout.write(f'{task}: попытка {task.attempts}')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Задачи выполнены.'))
@@ -0,0 +1,143 @@
+"""
+Task queue in the database.
+
+Functions are registered with @task decorator in tasks.py modules of apps
+and queued with enqueue (or func.enqueue) by views and signals. A task
+row is created in the transaction of the request, so the task is not lost
+if the request is committed and is not run if it is rolled back.
+
+run_tasks command takes queued tasks one by one, locking rows with
+SKIP LOCKED where the database supports it, so several workers can run
+at the same time. Failed tasks are retried with exponential delay
+up to max_attempts times. Tasks left running by a killed worker
+are taken again after TASKS_TIMEOUT seconds.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from tasks.models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+def task(name=None, max_attempts=3):
+    """
+    Registers the function as a task.
+    Arguments of the task and its result should be serializable to JSON.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        REGISTRY[task_name] = func
+
+        def enqueue_func(*args, user=None, run_after=None, **kwargs):
+            return enqueue(
+                task_name, *args, user=user, max_attempts=max_attempts,
+                run_after=run_after, **kwargs
+            )
+
+        func.task_name = task_name
+        func.enqueue = enqueue_func
+        return func
+    return decorator
+
+
+def enqueue(name, *args, user=None, max_attempts=3, run_after=None,
+            **kwargs):
+    """The task is run as soon as possible or not before run_after."""
+    if name not in REGISTRY:
+        raise KeyError(f'Task {name} is not registered')
+    return Task.objects.create(
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        user=user,
+        max_attempts=max_attempts,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(
+        seconds=getattr(settings, 'TASKS_RETRY_DELAY', 10)
+        * 2 ** (attempts - 1)
+    )
+
+
+def stuck_since(now):
+    return now - timedelta(seconds=getattr(settings, 'TASKS_TIMEOUT', 600))
+
+
+@transaction.atomic
+def claim():
+    """Marks the next task as running and returns it, None if no tasks."""
+    now = timezone.now()
+    Task.objects.filter(
+        status=Task.RUNNING,
+        started_at__lt=stuck_since(now),
+        attempts__gte=F('max_attempts'),
+    ).update(
+        status=Task.FAILED,
+        finished_at=now,
+        error='Timed out',
+    )
+    claimed = Task.objects.select_for_update(skip_locked=True).filter(
+        Q(status=Task.QUEUED, run_after__lte=now)
+        | Q(status=Task.RUNNING, started_at__lt=stuck_since(now))
+    ).order_by('run_after', 'pk').first()
+    if claimed is None:
+        return None
+    claimed.status = Task.RUNNING
+    claimed.attempts += 1
+    claimed.started_at = now
+    claimed.save(update_fields=['status', 'attempts', 'started_at'])
+    return claimed
+
+
+def run(claimed):
+    """Runs the claimed task and saves its result or schedules a retry."""
+    func = REGISTRY.get(claimed.name)
+    try:
+        if func is None:
+            raise KeyError(f'Task {claimed.name} is not registered')
+        claimed.result = func(*claimed.args, **claimed.kwargs)
+        claimed.status = Task.DONE
+        claimed.error = ''
+    except Exception as error:
+        logger.exception('Task %s failed', claimed)
+        claimed.error = f'{type(error).__name__}: {error}'
+        if claimed.attempts < claimed.max_attempts and func is not None:
+            claimed.status = Task.QUEUED
+            claimed.run_after = timezone.now() + retry_delay(
+                claimed.attempts
+            )
+        else:
+            claimed.status = Task.FAILED
+    if claimed.status != Task.QUEUED:
+        claimed.finished_at = timezone.now()
+    claimed.save(update_fields=[
+        'status', 'result', 'error', 'run_after', 'finished_at'
+    ])
+    return claimed
+
+
+def run_next():
+    """Runs one task, returns it or None if there are no tasks."""
+    claimed = claim()
+    if claimed is not None:
+        run(claimed)
+    return claimed
+
+
+def purge(days):
+    """Deletes finished tasks older than days."""
+    return Task.objects.filter(
+        status__in=(Task.DONE, Task.FAILED),
+        finished_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()[0]
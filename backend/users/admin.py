@@ -5,7 +5,8 @@ from .models import CustomUser, Subscription
 
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ('pk', 'username', 'email',
-                    'first_name', 'last_name')
+                    'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_editable = ('username', 'email',
                      'first_name', 'last_name')
     list_filter = ('username', 'email')
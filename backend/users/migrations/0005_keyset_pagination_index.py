@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_auto_20230905_1252'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['date_joined', 'id'], name='user_date_joined_id_idx'),
+        ),
+    ]
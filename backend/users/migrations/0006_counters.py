@@ -0,0 +1,46 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rows(model, field):
+    """Number of rows of the model referencing the outer row by field."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Subscription = apps.get_model('users', 'Subscription')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    CustomUser.objects.update(
+        recipes_count=count_rows(Recipe, 'author'),
+        followers_count=count_rows(Subscription, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_keyset_pagination_index'),
+        ('recipes', '0014_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='followers_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Number of users subscribed to the user'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Number of recipes of the user'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='state_version',
+            field=models.IntegerField(default=0, editable=False, help_text='Changed when favorites, shopping cart or subscriptions of the user change, used for ETag of responses'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_conditional_get'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='feed_synced_at',
+            field=models.DateTimeField(editable=False, help_text='Recipes of popular authors created after this time are not in the feed of the follower yet, see recipes.feed', null=True),
+        ),
+    ]
@@ -3,6 +3,9 @@ from django.contrib.auth.models import AbstractUser
 
 
 class CustomUser(AbstractUser):
+    # fields shown to other users, e.g. as the author of recipes
+    PUBLIC_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
     email = models.EmailField(
         max_length=254,
         unique=True,
@@ -19,10 +22,33 @@ class CustomUser(AbstractUser):
         blank=False,
         help_text='Surname'
     )
+    recipes_count = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text='Number of recipes of the user'
+    )
+    followers_count = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text='Number of users subscribed to the user'
+    )
+    state_version = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text='Changed when favorites, shopping cart or subscriptions '
+                  'of the user change, used for ETag of responses'
+    )
 
     class Meta:
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            # keyset pagination, see api.paginators.KeysetPagination
+            models.Index(
+                fields=['date_joined', 'id'],
+                name='user_date_joined_id_idx'
+            ),
+        ]
 
 
 class Subscription(models.Model):
@@ -38,6 +64,12 @@ class Subscription(models.Model):
         related_name='following',
         verbose_name='Content author (на кого подписан)'
     )
+    feed_synced_at = models.DateTimeField(
+        null=True,
+        editable=False,
+        help_text='Recipes of popular authors created after this time '
+                  'are not in the feed of the follower yet, see recipes.feed'
+    )
 
     class Meta:
         constraints = [
@@ -0,0 +1,40 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes import feed
+from users.models import CustomUser, Subscription
+
+
+@receiver(post_save, sender=Subscription)
+def increase_followers_count(instance, created, **kwargs):
+    if created:
+        CustomUser.objects.filter(pk=instance.author_id).update(
+            followers_count=F('followers_count') + 1
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def decrease_followers_count(instance, **kwargs):
+    CustomUser.objects.filter(pk=instance.author_id).update(
+        followers_count=F('followers_count') - 1
+    )
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def bump_user_state_version(instance, **kwargs):
+    """is_subscribed of authors is changed for the follower."""
+    CustomUser.objects.filter(pk=instance.user_id).update(
+        state_version=F('state_version') + 1
+    )
+
+
+@receiver(post_save, sender=Subscription)
+def add_author_recipes_to_feed(instance, created, **kwargs):
+    if created:
+        feed.follow(instance.user_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_author_recipes_from_feed(instance, **kwargs):
+    feed.unfollow(instance.user_id, [instance.author_id])